@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import subprocess
+
+# `import cacheer.manager` must stay within IMPORT_BUDGET seconds and must
+# not pull in any of HEAVY_MODULES, which are only imported on first use
+IMPORT_BUDGET = 0.1
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'pymongo', 'yaml', 'lmdb']
+
+
+def timeraw_import_manager():
+    return 'import cacheer.manager'
+
+
+timeraw_import_manager.timeout = 60
+
+
+def _import_seconds():
+    # cumulative import time of cacheer.manager, by -X importtime
+    err = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import cacheer.manager'],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    for line in err.splitlines():
+        fields = [f.strip() for f in line.split('|')]
+        if len(fields) == 3 and fields[2] == 'cacheer.manager':
+            return int(fields[1]) / 1e6
+    raise RuntimeError('no import time reported for cacheer.manager')
+
+
+def track_import_manager_seconds():
+    # best of a few runs, failing the benchmark once over budget
+    seconds = min(_import_seconds() for _ in range(3))
+    if seconds > IMPORT_BUDGET:
+        raise AssertionError('import cacheer.manager took {:.3f}s, over '
+                             'the {}s budget'.format(seconds, IMPORT_BUDGET))
+    return seconds
+
+
+track_import_manager_seconds.unit = 'seconds'
+
+
+def track_heavy_modules_imported():
+    code = ('import sys, cacheer.manager; '
+            'print(" ".join(m for m in {!r} if m in sys.modules))'.format(
+                HEAVY_MODULES))
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  universal_newlines=True)
+    imported = out.split()
+    if imported:
+        raise AssertionError('import cacheer.manager imported {}'.format(
+            ', '.join(imported)))
+    return len(imported)
+
+
+track_heavy_modules_imported.unit = 'modules'
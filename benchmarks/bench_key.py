@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from benchmarks.common import make_frame
+
+import numpy as np
+
+from cacheer.manager import gen_cache_key
+
+
+def _api(func, **meta):
+    func._api_meta = {'__api_name': func.__module__ + '.' + func.__qualname__}
+    func._api_meta.update(meta)
+    return func
+
+
+@_api
+def scalars(symbol, start, end, freq='1d', adjust=True):
+    pass
+
+
+@_api
+def listing(symbols, fields=None):
+    pass
+
+
+@_api
+def nested(query):
+    pass
+
+
+@_api
+def frame_arg(df, how='left'):
+    pass
+
+
+class Client:
+
+    def __init__(self):
+        self.db = 'research'
+
+    def query(self, symbol, start, end):
+        pass
+
+
+_api(Client.query, db='&self.db')
+
+
+class TimeGenCacheKey:
+
+    params = ['scalars', 'defaults', 'list-10k', 'nested', 'frame-100k',
+              'ndarray-1m', 'method']
+    param_names = ['shape']
+
+    def setup(self, shape):
+        if shape == 'scalars':
+            self.call = (scalars, ('000001.SZ', '20200101', '20240630'),
+                         {'freq': '1m', 'adjust': False})
+        elif shape == 'defaults':
+            self.call = (scalars, ('000001.SZ', '20200101', '20240630'), {})
+        elif shape == 'list-10k':
+            symbols = ['%06d.SZ' % i for i in range(10000)]
+            self.call = (listing, (symbols,), {'fields': ['open', 'close']})
+        elif shape == 'nested':
+            query = {'symbol': {'$in': ['%06d' % i for i in range(100)]},
+                     'dt': {'$gte': '20200101', '$lte': '20240630'},
+                     'fields': list(range(50))}
+            self.call = (nested, (query,), {})
+        elif shape == 'frame-100k':
+            self.call = (frame_arg, (make_frame(100000),), {})
+        elif shape == 'ndarray-1m':
+            self.call = (frame_arg, (np.arange(1000000.),), {})
+        elif shape == 'method':
+            client = Client()
+            self.call = (Client.query,
+                         (client, '000001.SZ', '20200101', '20240630'), {})
+
+    def time_gen_cache_key(self, shape):
+        func, args, kw = self.call
+        gen_cache_key(func, *args, **kw)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import os
+import itertools
+
+from benchmarks.common import (DictMetaDB, TokenClock, make_frame,
+                               make_tempdir, remove_tempdir)
+
+from cacheer.manager import CacheManager
+from cacheer.store import SqliteCacheStore
+
+BLOCK_ID = 'bench.block'
+
+
+class TimeCachedCall:
+    """
+    End-to-end wrapper overhead, with writes run inline so that the cost
+    of case 1/2.2 is part of the sample
+    """
+
+    params = (['hit', 'miss', 'outdated-unchanged', 'outdated-changed'],
+              [100, 100000])
+    param_names = ['case', 'nrows']
+    timeout = 300
+
+    def setup(self, case, nrows):
+        self.tmpdir = make_tempdir()
+        self.metadb = DictMetaDB()
+        self.clock = TokenClock()
+        self.manager = CacheManager(
+            SqliteCacheStore(os.path.join(self.tmpdir, 'cache')),
+            self.metadb)
+        self.manager._allow_background_workers = False
+        self.manager.allow_auto_register_api()
+
+        frame = make_frame(nrows)
+        counter = itertools.count(1)
+
+        @self.manager.cache(BLOCK_ID)
+        def load(i):
+            if case == 'outdated-changed':
+                frame.iat[0, 0] = next(counter)
+            return frame
+
+        self.load = load
+        self.keys = itertools.count(1)
+        self.notify_source_update()
+        self.load(0)
+
+    def teardown(self, case, nrows):
+        self.manager._background_workers.shutdown()
+        self.manager._cache_store._store.close()
+        remove_tempdir(self.tmpdir)
+
+    def notify_source_update(self):
+        self.manager.notify_source_update(BLOCK_ID, {'dt': self.clock()})
+
+    def time_call(self, case, nrows):
+        if case == 'hit':
+            self.load(0)
+        elif case == 'miss':
+            self.load(next(self.keys))
+        else:
+            self.notify_source_update()
+            self.load(0)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from benchmarks.common import make_frame, FRAME_DTYPES
+
+from cacheer import serializer as serializer_module
+
+SERIALIZERS = {
+    'Picklizer': serializer_module.Picklizer,
+    'Picklizer1': serializer_module.Picklizer1,
+    'Picklizer2': serializer_module.Picklizer2,
+    'Picklizer3': serializer_module.Picklizer3,
+    'typed': serializer_module.TypedSerializer(serializer_module.registry),
+    'oob': serializer_module.TypedSerializer(serializer_module.oob_registry),
+}
+
+
+class TimeSerializer:
+
+    params = (list(SERIALIZERS), [1000, 100000, 1000000], FRAME_DTYPES)
+    param_names = ['serializer', 'nrows', 'dtype']
+    timeout = 600
+
+    def setup(self, name, nrows, dtype):
+        self.serializer = SERIALIZERS[name]
+        self.frame = make_frame(nrows, dtype)
+        self.blob = self.serializer.serialize(self.frame)
+
+    def time_serialize(self, name, nrows, dtype):
+        self.serializer.serialize(self.frame)
+
+    def time_deserialize(self, name, nrows, dtype):
+        self.serializer.deserialize(self.blob)
+
+    def time_roundtrip(self, name, nrows, dtype):
+        self.serializer.deserialize(self.serializer.serialize(self.frame))
+
+    def time_gen_md5(self, name, nrows, dtype):
+        self.serializer.gen_md5(self.frame, value=True)
+
+    def track_size(self, name, nrows, dtype):
+        return len(self.blob)
+
+    track_size.unit = 'bytes'
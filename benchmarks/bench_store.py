@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+
+from benchmarks.common import (make_frame, make_tempdir, remove_tempdir,
+                               KB, MB, GB)
+
+import numpy as np
+
+from cacheer.store import SqliteCacheStore, ChunkedCacheStore
+
+_payloads = {}
+
+
+def _payload(size):
+    # pickled, as the store deserializes whatever it reads back
+    if size not in _payloads:
+        raw = np.random.RandomState(0).bytes(size)
+        _payloads[size] = pickle.dumps(raw, pickle.HIGHEST_PROTOCOL)
+    return _payloads[size]
+
+
+class TimeSqliteCacheStore:
+
+    params = [KB, MB, 64 * MB, GB]
+    param_names = ['size']
+
+    # every sample writes/reads the whole payload once; setup runs
+    # before each sample to keep the db from growing
+    number = 1
+    repeat = 5
+    warmup_time = 0
+    timeout = 1200
+
+    def setup(self, size):
+        self.tmpdir = make_tempdir()
+        self.store = SqliteCacheStore(os.path.join(self.tmpdir, 'cache'))
+        self.value = _payload(size)
+        self.store.write('existing', self.value)
+
+    def teardown(self, size):
+        self.store._store.close()
+        remove_tempdir(self.tmpdir)
+
+    def time_write(self, size):
+        self.store.write('new', self.value)
+
+    def time_overwrite(self, size):
+        self.store.write('existing', self.value)
+
+    def time_read(self, size):
+        self.store.read('existing')
+
+    def time_has_key(self, size):
+        self.store.has_key('existing')
+
+
+class TimeSqliteCacheMeta:
+
+    params = [10, 1000, 10000]
+    param_names = ['entries']
+
+    def setup(self, entries):
+        self.tmpdir = make_tempdir()
+        self.store = SqliteCacheStore(os.path.join(self.tmpdir, 'cache'))
+        for i in range(entries):
+            self.store.write_meta('%032x' % i, {
+                'key': '%032x' % i, 'token': i, 'hash': '%032x' % i})
+
+    def teardown(self, entries):
+        self.store._store.close()
+        remove_tempdir(self.tmpdir)
+
+    def time_read_meta(self, entries):
+        self.store.read_meta('%032x' % 0)
+
+    def time_write_meta(self, entries):
+        self.store.write_meta('%032x' % 0, {
+            'key': '%032x' % 0, 'token': 1, 'hash': '%032x' % 0})
+
+    def time_read_all_meta(self, entries):
+        self.store.read_all_meta()
+
+
+class TimeOverlappingValues:
+    """
+    Writes of a frame differing from a stored one in a single column
+    """
+
+    params = ['sqlite', 'chunked']
+    param_names = ['store']
+    number = 1
+    repeat = 5
+    warmup_time = 0
+
+    def setup(self, store):
+        self.tmpdir = make_tempdir()
+        cls = {'sqlite': SqliteCacheStore, 'chunked': ChunkedCacheStore}
+        self.store = cls[store](os.path.join(self.tmpdir, 'cache'))
+        self.frame = make_frame(1000000, 'float64')
+        self.store.write('base', self.frame)
+        self.changed = self.frame.copy()
+        self.changed.iloc[:, 0] = 0.
+
+    def teardown(self, store):
+        self.store._store.close()
+        remove_tempdir(self.tmpdir)
+
+    def time_write(self, store):
+        self.store.write('changed', self.changed)
+
+    def track_db_size(self, store):
+        self.store.write('changed', self.changed)
+        return os.path.getsize(self.store.db_path + '.db')
+
+    track_db_size.unit = 'bytes'
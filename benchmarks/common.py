@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shared fixtures of the benchmark suite
+
+Importing this module points `CACHEER_CONFIG` at benchmarks/config.yaml
+(unless already set), so it has to be imported before anything from
+`cacheer`.
+"""
+
+import os
+import shutil
+import tempfile
+import datetime
+
+os.environ.setdefault(
+    'CACHEER_CONFIG', os.path.join(os.path.dirname(__file__), 'config.yaml'))
+
+import numpy as np
+import pandas as pd
+
+from cacheer.store import MongoMetaDB
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+FRAME_DTYPES = ['float64', 'int64', 'datetime', 'str', 'category', 'mixed']
+
+
+class DictMetaDB(MongoMetaDB):
+    """
+    In-process stand-in for MongoMetaDB
+
+    Keeps api map and update status in plain dicts, while reusing the
+    block id/token resolution of MongoMetaDB.
+    """
+
+    def __init__(self, update_interval=0):
+        super().__init__()
+        self._update_interval = update_interval
+        self._api_docs = {'*': {'api_name': '*', 'block_id': ''}}
+        self._status_docs = {}
+
+    def read_update_status(self):
+        self._update_status = dict(self._status_docs)
+
+    def add_api(self, api_name, block_id):
+        self._api_docs[api_name] = {'api_name': api_name,
+                                    'block_id': block_id}
+        self.load_api_map()
+
+    def load_api_map(self, coll=None):
+        self._api_map = dict(self._api_docs)
+
+    def update(self, block_id, meta, **kw):
+        for sub_id in self._split_block_id(block_id):
+            self._status_docs[sub_id] = meta['dt']
+
+
+class TokenClock:
+    """
+    Strictly increasing tokens, independent of the wall clock resolution
+    """
+
+    def __init__(self):
+        self._base = datetime.datetime(2000, 1, 1)
+        self._ticks = 0
+
+    def __call__(self):
+        self._ticks += 1
+        return self._base + datetime.timedelta(seconds=self._ticks)
+
+
+def make_frame(nrows, dtype='float64', ncols=8, seed=0):
+    rs = np.random.RandomState(seed)
+
+    def _column(kind):
+        if kind == 'float64':
+            return rs.standard_normal(nrows)
+        if kind == 'int64':
+            return rs.randint(0, 1 << 30, nrows).astype('int64')
+        if kind == 'datetime':
+            return pd.date_range('2000-01-01', periods=nrows, freq='min')
+        if kind == 'str':
+            return rs.choice(['%06d' % i for i in range(1000)], nrows)
+        if kind == 'category':
+            return pd.Categorical(
+                rs.choice(['%06d' % i for i in range(100)], nrows))
+        raise ValueError(kind)
+
+    if dtype == 'mixed':
+        kinds = [FRAME_DTYPES[i % 5] for i in range(ncols)]
+    else:
+        kinds = [dtype] * ncols
+
+    return pd.DataFrame({f'c{i}': _column(k) for i, k in enumerate(kinds)})
+
+
+def make_tempdir():
+    return tempfile.mkdtemp(prefix='cacheer-bench-')
+
+
+def remove_tempdir(path):
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+"""
+Concurrent load generator
+
+Runs N processes x M threads calling a cached function against one shared
+sqlite cache. Arguments follow a Zipf distribution over a fixed key space,
+and the parent process periodically calls `notify_source_update` through
+a sqlite-backed metadb stand-in, so tokens advance while readers and
+`CacheWriter` threads are busy.
+
+    python -m benchmarks.loadtest --processes 8 --threads 4 --duration 60 \\
+        --keys 10000 --zipf 1.1 --value-size 4KB,256KB,8MB \\
+        --update-interval 5 --output loadtest.json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import sqlite3
+import argparse
+import datetime
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.common import make_tempdir, remove_tempdir, KB, MB, GB
+
+import numpy as np
+
+from cacheer.manager import CacheManager
+from cacheer.store import SqliteStore, MongoMetaDB
+from cacheer import store as store_module
+from cacheer.writer import WriterDaemon, WriterClientStore
+
+BLOCK_ID = 'loadtest.block'
+
+OUTCOMES = ['hit', 'compute', 'error']
+
+
+class SqliteMetaDB(MongoMetaDB):
+    """
+    Metadb stand-in shared by all processes through a sqlite file
+
+    Token resolution and refresh interval are inherited from MongoMetaDB.
+    """
+
+    def __init__(self, db_path, update_interval=10):
+        super().__init__()
+        self._update_interval = update_interval
+        self._apis = SqliteStore(db_path, 'api_map', ['api_name', 'block_id'])
+        self._apis.add_index('api_name', unique=True)
+        self._status = SqliteStore(db_path, 'update_status', ['block_id', 'dt'])
+        self._status.add_index('block_id', unique=True)
+
+    @staticmethod
+    def _upsert(store, field, doc):
+        try:
+            store.write(doc)
+        except sqlite3.IntegrityError:
+            store.update(query={field: doc[field]}, document=doc)
+
+    def read_update_status(self):
+        self._update_status = {
+            doc['block_id']: datetime.datetime.fromtimestamp(doc['dt'])
+            for doc in self._status.read()}
+
+    def add_api(self, api_name, block_id):
+        self._upsert(self._apis, 'api_name',
+                     {'api_name': api_name, 'block_id': block_id})
+        self.load_api_map()
+
+    def load_api_map(self, coll=None):
+        self._api_map = {doc['api_name']: doc for doc in self._apis.read()}
+
+    def update(self, block_id, meta, **kw):
+        for sub_id in self._split_block_id(block_id):
+            self._upsert(self._status, 'block_id',
+                         {'block_id': sub_id, 'dt': meta['dt'].timestamp()})
+
+
+class ZipfKeys:
+    """
+    Bounded Zipf sampler over range(n), P(k) ~ 1 / (k + 1) ** s
+    """
+
+    def __init__(self, n, s, seed):
+        weights = 1. / np.arange(1, n + 1) ** s
+        self._cdf = np.cumsum(weights) / weights.sum()
+        self._rs = np.random.RandomState(seed)
+
+    def sample(self, size):
+        return np.searchsorted(self._cdf, self._rs.random_sample(size))
+
+
+_state = threading.local()
+_inflight = collections.Counter()
+_inflight_lock = threading.Lock()
+_concurrent_computes = 0
+
+
+def compute(k, size, compute_ms, mutate):
+    """
+    The cached function: sleeps to emulate an upstream query and returns
+    a payload of `size` bytes
+    """
+    global _concurrent_computes
+    _state.computed = True
+
+    with _inflight_lock:
+        if _inflight[k]:
+            _concurrent_computes += 1
+        _inflight[k] += 1
+    try:
+        time.sleep(compute_ms / 1000.)
+        payload = np.random.RandomState(k).bytes(size)
+        if mutate:
+            payload = repr(time.time()).encode() + payload
+        return {'key': k, 'payload': payload}
+    finally:
+        with _inflight_lock:
+            _inflight[k] -= 1
+
+
+class _ErrorCounter(logging.Handler):
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def _open_store(opts, use_writer=True):
+    if opts.store == 'sharded':
+        store = store_module.ShardedCacheStore(opts.cache_path, opts.shards)
+    else:
+        store = store_module.CACHE_STORES[opts.store](opts.cache_path)
+    if use_writer and opts.writer:
+        store = WriterClientStore(store, opts.writer_socket)
+    return store
+
+
+def _run_worker(opts, worker_id):
+    manager = CacheManager(
+        _open_store(opts),
+        SqliteMetaDB(opts.metadb_path, opts.token_refresh))
+    manager.allow_auto_register_api()
+    cached = manager.cache(BLOCK_ID)(compute)
+
+    errors = _ErrorCounter()
+    logging.getLogger('cacheer.manager').addHandler(errors)
+
+    sizes = opts.value_size
+    latencies = {o: [] for o in OUTCOMES}
+    deadline = time.time() + opts.duration
+
+    def _run_thread(thread_id):
+        keys = ZipfKeys(opts.keys, opts.zipf,
+                        seed=worker_id * 1000 + thread_id)
+        local = {o: [] for o in OUTCOMES}
+        while time.time() < deadline:
+            for k in keys.sample(256).tolist():
+                _state.computed = False
+                t0 = time.perf_counter()
+                try:
+                    cached(k, sizes[k % len(sizes)],
+                           opts.compute_ms, opts.mutate)
+                    outcome = 'compute' if _state.computed else 'hit'
+                except Exception:
+                    outcome = 'error'
+                local[outcome].append(time.perf_counter() - t0)
+        for o in OUTCOMES:
+            latencies[o].extend(local[o])
+
+    threads = [threading.Thread(target=_run_thread, args=(i,))
+               for i in range(opts.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    t0 = time.time()
+    manager.flush()
+    drain = time.time() - t0
+
+    return {
+        'latencies': latencies,
+        'concurrent_computes': _concurrent_computes,
+        'logged_errors': errors.count,
+        'drain_seconds': drain,
+    }
+
+
+def _notify_periodically(opts, stop):
+    manager = CacheManager(
+        _open_store(opts),
+        SqliteMetaDB(opts.metadb_path, opts.token_refresh))
+    count = 0
+    while not stop.wait(opts.update_interval):
+        manager.notify_source_update(
+            BLOCK_ID, {'dt': datetime.datetime.now()})
+        count += 1
+    return count
+
+
+def summarize(results, elapsed):
+    latencies = {o: [] for o in OUTCOMES}
+    for res in results:
+        for o in OUTCOMES:
+            latencies[o].extend(res['latencies'][o])
+
+    total = sum(len(v) for v in latencies.values())
+    summary = {
+        'calls': total,
+        'elapsed_seconds': elapsed,
+        'throughput': total / elapsed,
+        'concurrent_computes': sum(
+            r['concurrent_computes'] for r in results),
+        'logged_errors': sum(r['logged_errors'] for r in results),
+        'max_drain_seconds': max(r['drain_seconds'] for r in results),
+        'outcomes': {},
+    }
+    for o in OUTCOMES:
+        values = np.asarray(latencies[o]) * 1000.
+        if not len(values):
+            continue
+        p50, p99, p999 = np.percentile(values, [50, 99, 99.9])
+        summary['outcomes'][o] = {
+            'count': len(values),
+            'throughput': len(values) / elapsed,
+            'p50_ms': p50, 'p99_ms': p99, 'p999_ms': p999,
+        }
+    return summary
+
+
+def format_summary(summary):
+    lines = [
+        '{calls} calls in {elapsed_seconds:.1f}s, {throughput:.1f} calls/s'
+        .format(**summary),
+        'concurrent computes of one key (per process): {}'.format(
+            summary['concurrent_computes']),
+        'errors logged by cacheer: {}'.format(summary['logged_errors']),
+        'slowest writer drain: {:.2f}s'.format(summary['max_drain_seconds']),
+        '',
+        '{:<8} {:>9} {:>10} {:>10} {:>10} {:>10}'.format(
+            'outcome', 'count', 'calls/s', 'p50 ms', 'p99 ms', 'p999 ms'),
+    ]
+    for o, s in summary['outcomes'].items():
+        lines.append(
+            '{:<8} {count:>9} {throughput:>10.1f} {p50_ms:>10.3f} '
+            '{p99_ms:>10.3f} {p999_ms:>10.3f}'.format(o, **s))
+    return '\n'.join(lines)
+
+
+def parse_size(s):
+    units = {'GB': GB, 'MB': MB, 'KB': KB, 'B': 1}
+    s = s.strip().upper()
+    for unit, factor in units.items():
+        if s.endswith(unit):
+            return int(float(s[:-len(unit)]) * factor)
+    return int(s)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.loadtest',
+        description='Concurrent load test against one shared sqlite cache')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds of load per process')
+    parser.add_argument('--keys', type=int, default=1000,
+                        help='size of the key space')
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help='Zipf exponent of key popularity')
+    parser.add_argument('--value-size', default='4KB',
+                        type=lambda s: [parse_size(i) for i in s.split(',')],
+                        help='comma separated sizes, assigned per key')
+    parser.add_argument('--compute-ms', type=float, default=5,
+                        help='simulated upstream latency of a compute')
+    parser.add_argument('--mutate', action='store_true',
+                        help='recomputed values differ from cached ones')
+    parser.add_argument('--update-interval', type=float, default=5,
+                        help='seconds between notify_source_update calls')
+    parser.add_argument('--token-refresh', type=float, default=10,
+                        help='metadb update status refresh interval')
+    parser.add_argument('--store', default='sqlite',
+                        choices=sorted(store_module.CACHE_STORES),
+                        help='cache store, as `cache-store` in config')
+    parser.add_argument('--shards', type=int, default=8,
+                        help='shard count of the sharded store')
+    parser.add_argument('--writer', action='store_true',
+                        help='hand writes to a writer daemon')
+    parser.add_argument('--workdir', default=None,
+                        help='directory of cache/metadb files, '
+                             'a temporary one by default')
+    parser.add_argument('--output', default=None,
+                        help='save the summary as json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+
+    workdir = opts.workdir or make_tempdir()
+    opts.cache_path = os.path.join(workdir, 'cache')
+    opts.metadb_path = os.path.join(workdir, 'metadb')
+    opts.writer_socket = os.path.join(workdir, 'writer.sock')
+
+    writer = None
+    if opts.writer:
+        writer = WriterDaemon(opts.writer_socket,
+                              _open_store(opts, use_writer=False))
+        writer_thread = threading.Thread(target=writer.serve_forever)
+        writer_thread.start()
+        while not os.path.exists(opts.writer_socket):
+            time.sleep(0.01)
+
+    metadb = SqliteMetaDB(opts.metadb_path)
+    metadb.add_api('*', '')
+    metadb.update(BLOCK_ID, {'dt': datetime.datetime.now()})
+
+    stop = threading.Event()
+    updates = []
+    notifier = threading.Thread(
+        target=lambda: updates.append(_notify_periodically(opts, stop)))
+    notifier.start()
+
+    ctx = multiprocessing.get_context('fork')
+    t0 = time.time()
+    try:
+        with ProcessPoolExecutor(opts.processes, mp_context=ctx) as pool:
+            futures = [pool.submit(_run_worker, opts, i)
+                       for i in range(opts.processes)]
+            results = [f.result() for f in futures]
+    finally:
+        stop.set()
+        notifier.join()
+        if writer is not None:
+            writer.shutdown()
+            writer_thread.join()
+        if opts.workdir is None:
+            remove_tempdir(workdir)
+    elapsed = time.time() - t0
+
+    summary = summarize(results, elapsed)
+    summary['source_updates'] = updates[0]
+    summary['options'] = {k: v for k, v in vars(opts).items()}
+
+    print(format_summary(summary))
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
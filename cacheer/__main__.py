@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+    python -m cacheer writer [--socket PATH] [--store NAME]
+    python -m cacheer serve [--socket PATH] [--store NAME] [--memory SIZE]
+    python -m cacheer compact [--store NAME]
+    python -m cacheer export-pack PATH [--store NAME] [--api API ...]
+    python -m cacheer import-pack PATH [--store NAME]
+"""
+
+import sys
+import signal
+import logging
+import argparse
+
+
+def run_writer(opts):
+    from cacheer.settings import conf
+    from cacheer.store import open_cache_store
+    from cacheer.writer import WriterDaemon
+
+    path = opts.socket or conf.get('writer-socket')
+    if not path:
+        sys.exit('no socket path, set --socket or writer-socket in config')
+
+    daemon = WriterDaemon(
+        path, open_cache_store(opts.store, remote=False),
+        batch_size=conf.get('writer-batch-size', 256),
+        batch_bytes=conf.get('writer-batch-bytes', 64 * 1024 * 1024),
+        vacuum_interval=conf.get('sqlite-vacuum-interval', 60),
+        max_bytes=conf.get('writer-queue-max-bytes', 1024 ** 3),
+        policy=conf.get('writer-queue-policy', 'block'))
+    signal.signal(signal.SIGTERM, lambda *args: daemon.shutdown())
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_server(opts):
+    from cacheer.settings import conf
+    from cacheer.store import open_cache_store
+    from cacheer.server import CacheServer
+
+    path = opts.socket or conf.get('server-socket')
+    if not path:
+        sys.exit('no socket path, set --socket or server-socket in config')
+
+    server = CacheServer(
+        path, open_cache_store(opts.store, remote=False),
+        memory_bytes=opts.memory or conf.get('server-memory-bytes',
+                                             1024 ** 3),
+        batch_size=conf.get('writer-batch-size', 256),
+        batch_bytes=conf.get('writer-batch-bytes', 64 * 1024 * 1024),
+        vacuum_interval=conf.get('sqlite-vacuum-interval', 60),
+        max_bytes=conf.get('writer-queue-max-bytes', 1024 ** 3),
+        policy=conf.get('writer-queue-policy', 'block'))
+    signal.signal(signal.SIGTERM, lambda *args: server.shutdown())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_compact(opts):
+    from cacheer.store import open_cache_store
+
+    store = open_cache_store(opts.store, remote=False)
+    if not hasattr(store, 'compact'):
+        sys.exit('{} can\'t be compacted'.format(type(store).__name__))
+
+    stats = store.compact()
+    mb = 1024 ** 2
+    print('{}: {:.1f} MB -> {:.1f} MB, {:.1f} MB reclaimed in {:.1f}s'.format(
+        type(store).__name__, stats['size_before'] / mb,
+        stats['size_after'] / mb,
+        (stats['size_before'] - stats['size_after']) / mb, stats['seconds']))
+    store.close()
+
+
+def run_export_pack(opts):
+    from cacheer.store import open_cache_store
+    from cacheer.pack import export_pack
+
+    store = open_cache_store(opts.store, remote=False)
+    stats = export_pack(store, opts.path, apis=opts.api)
+    print('{} entries, {} values, {:.1f} MB written to {} in {:.1f}s'.format(
+        stats['entries'], stats['values'], stats['bytes'] / 1024 ** 2,
+        opts.path, stats['seconds']))
+    store.close()
+
+
+def run_import_pack(opts):
+    from cacheer.store import open_cache_store
+    from cacheer.pack import import_pack
+
+    store = open_cache_store(opts.store, remote=False)
+    stats = import_pack(opts.path, store)
+    print('{} entries, {} new values imported from {} in {:.1f}s'.format(
+        stats['entries'], stats['values'], opts.path, stats['seconds']))
+    store.close()
+
+
+def parse_size(s):
+    units = {'GB': 1024 ** 3, 'MB': 1024 ** 2, 'KB': 1024, 'B': 1}
+    s = s.strip().upper()
+    for unit, factor in units.items():
+        if s.endswith(unit):
+            return int(float(s[:-len(unit)]) * factor)
+    return int(s)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cacheer')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    writer = commands.add_parser(
+        'writer', help='apply the cache writes of all processes of a node')
+    writer.add_argument('--socket', default=None,
+                        help='Unix socket to listen on, writer-socket of '
+                             'config by default')
+    writer.add_argument('--store', default=None,
+                        help='cache store, cache-store of config by default')
+    writer.set_defaults(func=run_writer)
+
+    server = commands.add_parser(
+        'serve', help='serve the cache of a node from one process, with a '
+                      'memory tier shared by all its processes')
+    server.add_argument('--socket', default=None,
+                        help='Unix socket to listen on, server-socket of '
+                             'config by default')
+    server.add_argument('--store', default=None,
+                        help='cache store, cache-store of config by default')
+    server.add_argument('--memory', default=None, type=parse_size,
+                        help='memory tier size, e.g. 4GB, '
+                             'server-memory-bytes of config by default')
+    server.set_defaults(func=run_server)
+
+    compact = commands.add_parser(
+        'compact', help='rewrite the cache files without free space, while '
+                        'nothing else writes to them')
+    compact.add_argument('--store', default=None,
+                         help='cache store, cache-store of config by default')
+    compact.set_defaults(func=run_compact)
+
+    export = commands.add_parser(
+        'export-pack', help='write cache entries to an immutable pack file, '
+                            'for read-only use with cache-store: pack')
+    export.add_argument('path', help='pack file to write')
+    export.add_argument('--store', default=None,
+                        help='cache store, cache-store of config by default')
+    export.add_argument('--api', nargs='+', default=None,
+                        help='only export entries of these APIs')
+    export.set_defaults(func=run_export_pack)
+
+    import_ = commands.add_parser(
+        'import-pack', help='write the entries of a pack file to a cache '
+                            'store')
+    import_.add_argument('path', help='pack file to read')
+    import_.add_argument('--store', default=None,
+                         help='cache store, cache-store of config by default')
+    import_.set_defaults(func=run_import_pack)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s')
+    return opts.func(opts)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
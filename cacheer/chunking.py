@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content-defined chunking of serialized values
+
+Boundaries are placed where a hash of the last `window` bytes has its top
+bits all zero, so they follow the content rather than offsets: an insertion
+or a changed column only alters the chunks around it, and the chunks of
+otherwise equal values are shared.
+"""
+
+_MIX = 0x9E3779B1
+
+_gear = None
+
+
+def _gear_table():
+    global _gear
+    if _gear is None:
+        import numpy as np
+        rs = np.random.RandomState(0x63636872)
+        _gear = rs.randint(0, 2 ** 32, 256, dtype=np.int64).astype(np.uint32)
+    return _gear
+
+
+def cdc_boundaries(buf, avg_size=64 * 1024, window=48,
+                   block=1024 * 1024):
+    """
+    End offsets of the chunks of `buf`, chunks being `avg_size` on average,
+    and between a quarter and four times that
+
+    Window hashes are computed `block` bytes at a time, as sums of per-byte
+    random values over a cumulative sum, mixed by a multiplication.
+    """
+    import numpy as np
+
+    data = np.frombuffer(buf, dtype=np.uint8)
+    n = len(data)
+    min_size, max_size = avg_size // 4, avg_size * 4
+    shift = np.uint32(32 - max(avg_size.bit_length() - 1, 1))
+    gear = _gear_table()
+
+    cuts, last = [], 0
+    for off in range(0, n, block):
+        lo = max(off - window, 0)
+        cs = np.cumsum(gear[data[lo:off + block]], dtype=np.uint32)
+        h = cs.copy()
+        h[window:] -= cs[:-window]
+        h = h[off - lo:]
+        h *= np.uint32(_MIX)
+        candidates = np.flatnonzero((h >> shift) == 0) + (off + 1)
+
+        for c in candidates.tolist():
+            while c - last > max_size:
+                last += max_size
+                cuts.append(last)
+            if c - last >= min_size:
+                cuts.append(c)
+                last = c
+
+    while n - last > max_size:
+        last += max_size
+        cuts.append(last)
+    if last < n:
+        cuts.append(n)
+    return cuts
+
+
+def split(buf, avg_size=64 * 1024):
+    """
+    Content-defined chunks of `buf`, as memoryviews
+    """
+    view = memoryview(buf).cast('B')
+    start, chunks = 0, []
+    for end in cdc_boundaries(view, avg_size):
+        chunks.append(view[start:end])
+        start = end
+    return chunks
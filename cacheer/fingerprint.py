@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fingerprints of large arguments in cache keys
+
+numpy arrays, pandas objects and Arrow tables/arrays of at least
+`fingerprint-min-bytes` are replaced in the pickled key arguments by a
+digest of their buffers, so building a key doesn't pickle a copy of them.
+Large buffers are hashed in parallel pieces (hashlib releases the GIL).
+
+With `fingerprint-memo` set, fingerprints of read-only arrays over immutable
+memory (bytes, read-only maps), whose data can't change under them, are
+remembered by identity for as long as the array lives.
+
+`content_hash` digests a value from the same fingerprints, whatever its
+memory layout or pickled form, to tell whether a recomputed value changed.
+"""
+
+import os
+import sys
+import mmap
+import pickle
+import hashlib
+import weakref
+import threading
+
+from cacheer.settings import conf
+
+# hashed in pieces of this size, in parallel, past `_PARALLEL_BYTES`
+_PIECE_BYTES = 8 * 1024 * 1024
+_PARALLEL_BYTES = 4 * _PIECE_BYTES
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_min_bytes = None
+_memo_enabled = None
+
+
+def _reset_executor():
+    # threads of the pool don't survive fork
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _pool = ThreadPoolExecutor(4, thread_name_prefix='Fingerprint')
+    return _pool
+
+
+def _sha1(buf):
+    return hashlib.sha1(buf).digest()
+
+
+def digest(buf):
+    """
+    Digest of the bytes of a contiguous buffer
+    """
+    view = memoryview(buf).cast('B')
+    if view.nbytes <= _PARALLEL_BYTES:
+        return _sha1(view)
+    pieces = [view[i:i + _PIECE_BYTES]
+              for i in range(0, view.nbytes, _PIECE_BYTES)]
+    return _sha1(b''.join(_executor().map(_sha1, pieces)))
+
+
+class _IdentityMemo:
+    """
+    Fingerprints by object id, dropped when the object is collected
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, obj):
+        item = self._items.get(id(obj))
+        if item is not None and item[0]() is obj:
+            return item[1]
+        return None
+
+    def put(self, obj, fp):
+        key = id(obj)
+
+        def _drop(_, key=key):
+            with self._lock:
+                self._items.pop(key, None)
+
+        with self._lock:
+            self._items[key] = (weakref.ref(obj, _drop), fp)
+
+
+_memo = _IdentityMemo()
+
+
+def _memo_on():
+    global _memo_enabled
+    if _memo_enabled is None:
+        _memo_enabled = bool(conf.get('fingerprint-memo', False))
+    return _memo_enabled
+
+
+def _frozen(arr):
+    # read-only down to memory nobody can write: an array owning its data
+    # can be made writeable again, only bytes and read-only maps can't
+    while hasattr(arr, 'flags'):
+        if arr.flags.writeable:
+            return False
+        arr = arr.base
+    if isinstance(arr, memoryview):
+        if not arr.readonly:
+            return False
+        arr = arr.obj
+    if isinstance(arr, mmap.mmap):
+        with memoryview(arr) as view:
+            return view.readonly
+    return isinstance(arr, bytes)
+
+
+class _NotCanonical(Exception):
+    # values whose hash could match values of another type
+    pass
+
+
+def _dtype_fingerprint(dtype):
+    # structured dtypes by their fields, not just their item size
+    return str(dtype.descr) if dtype.names else dtype.str
+
+
+def _ndarray_fingerprint(arr):
+    import numpy as np
+
+    memo = _memo_on() and _frozen(arr)
+    if memo:
+        fp = _memo.get(arr)
+        if fp is not None:
+            return fp
+    fp = ('__ndarray__', _dtype_fingerprint(arr.dtype), arr.shape,
+          digest(np.ascontiguousarray(arr).reshape(-1).view('u1')))
+    if memo:
+        _memo.put(arr, fp)
+    return fp
+
+
+def _hashes_exactly(values):
+    # whether the pandas hash tells apart any two different values, which
+    # it doesn't for objects of other types than str, hashed as their str
+    import pandas as pd
+    from pandas.api import types
+
+    dtype = values.dtype
+    if dtype == object:
+        return types.infer_dtype(values, skipna=False) == 'string'
+    return isinstance(dtype, (pd.StringDtype, pd.CategoricalDtype,
+                              pd.DatetimeTZDtype)) or \
+        types.is_numeric_dtype(dtype) or types.is_bool_dtype(dtype)
+
+
+def _values_fingerprint(values):
+    # a column or an index, by its numpy values when plain, else by the
+    # vectorized pandas hash of each of its values
+    import numpy as np
+    import pandas as pd
+
+    dtype = values.dtype
+    if isinstance(dtype, np.dtype) and not dtype.hasobject:
+        return _ndarray_fingerprint(values.to_numpy())
+    if not _hashes_exactly(values):
+        raise _NotCanonical
+    hashed = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    if isinstance(dtype, pd.CategoricalDtype):  # values hashed, not codes
+        return ('__hashed__', str(dtype), dtype.ordered,
+                _values_fingerprint(dtype.categories),
+                digest(hashed.view('u1')))
+    return ('__hashed__', str(dtype), digest(hashed.view('u1')))
+
+
+def _index_fingerprint(index):
+    import pandas as pd
+
+    if isinstance(index, pd.RangeIndex):
+        return ('__range__', index.start, index.stop, index.step, index.name)
+    if isinstance(index, pd.MultiIndex):
+        return ('__multi__', tuple(index.names),
+                tuple(_values_fingerprint(index.get_level_values(i))
+                      for i in range(index.nlevels)))
+    return ('__index__', index.name, _values_fingerprint(index))
+
+
+def _frame_fingerprint(df):
+    columns = tuple(
+        _values_fingerprint(df.iloc[:, i]) for i in range(df.shape[1]))
+    return ('__frame__', tuple(df.columns), tuple(map(str, df.dtypes)),
+            _index_fingerprint(df.index), columns)
+
+
+def _series_fingerprint(s):
+    return ('__series__', s.name, str(s.dtype), _index_fingerprint(s.index),
+            _values_fingerprint(s))
+
+
+def _arrow_fingerprint(obj):
+    import pyarrow as pa
+
+    h = hashlib.sha1(str(obj.type if isinstance(obj, pa.Array)
+                         else obj.schema).encode())
+    chunks = obj.chunks if isinstance(obj, pa.ChunkedArray) else \
+        [c for col in obj.columns for c in col.chunks] \
+        if isinstance(obj, pa.Table) else [obj]
+    for chunk in chunks:
+        # slices share buffers, told apart by offset and length
+        h.update(b'%d:%d:%d' % (chunk.offset, len(chunk), chunk.null_count))
+        for buf in chunk.buffers():
+            if buf is not None:
+                h.update(digest(buf))
+    return ('__arrow__', type(obj).__name__, h.digest())
+
+
+_SCALARS = (str, bytes, int, float, bool, complex, type(None))
+
+
+def _canonical(obj):
+    # fingerprints of arrays and frames, and plain containers of them with
+    # dict items in a set order
+    cls = type(obj)
+    if cls in _SCALARS:
+        return obj
+    if cls in (list, tuple):
+        return (cls.__name__, tuple(_canonical(i) for i in obj))
+    if cls is dict:
+        items = [(_canonical(k), _canonical(v)) for k, v in obj.items()]
+        return ('dict', tuple(sorted(items, key=lambda item: repr(item[0]))))
+
+    module = cls.__module__.partition('.')[0]
+    if module == 'numpy':
+        import numpy as np
+        if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+            return _ndarray_fingerprint(obj)
+        if isinstance(obj, np.generic) and not obj.dtype.hasobject:
+            return ('__scalar__', _dtype_fingerprint(obj.dtype),
+                    obj.tobytes())
+    elif module == 'pandas':
+        import pandas as pd
+        if isinstance(obj, pd.DataFrame):
+            # column labels with their type and name
+            return ('__frame__', _index_fingerprint(obj.columns),
+                    _frame_fingerprint(obj))
+        if isinstance(obj, pd.Series):
+            return _series_fingerprint(obj)
+        if isinstance(obj, pd.Index):
+            return _index_fingerprint(obj)
+    elif module == 'pyarrow':
+        import pyarrow as pa
+        if isinstance(obj, (pa.Table, pa.ChunkedArray, pa.Array)):
+            return _arrow_fingerprint(obj)
+    raise _NotCanonical
+
+
+def content_hash(obj):
+    """
+    md5 of the content of `obj`, independent of its memory layout and
+    pickled form, or None if `obj` isn't made only of arrays, DataFrames,
+    Series, Arrow tables, scalars and lists, tuples and dicts of them
+
+    Columns are hashed one by one, from their buffers, or with the
+    vectorized pandas hash for str, categorical and numeric extension
+    dtypes. Columns of other objects, or of unhashable values, leave the
+    value without a content hash.
+    """
+    try:
+        canonical = _canonical(obj)
+    except (_NotCanonical, TypeError, ValueError):
+        return None
+    return hashlib.md5(
+        pickle.dumps(canonical, pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+def _nbytes(obj):
+    nbytes = getattr(obj, 'nbytes', None)  # numpy, Arrow
+    if isinstance(nbytes, int):
+        return nbytes
+    if hasattr(obj, 'memory_usage'):  # pandas
+        usage = obj.memory_usage(index=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    return 0
+
+
+def fingerprint(obj):
+    """
+    A digest standing for `obj` if it's a large array, DataFrame, Series
+    or Arrow table/array, `obj` itself otherwise
+    """
+    global _min_bytes
+
+    module = type(obj).__module__.partition('.')[0]
+    if module not in ('numpy', 'pandas', 'pyarrow'):
+        return obj
+    if _min_bytes is None:
+        _min_bytes = conf.get('fingerprint-min-bytes', 1024 * 1024)
+    if _nbytes(obj) < _min_bytes:
+        return obj
+
+    np = sys.modules.get('numpy')
+    pd = sys.modules.get('pandas')
+    pa = sys.modules.get('pyarrow')
+    if np is not None and isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            return obj
+        return _ndarray_fingerprint(obj)
+    try:
+        if pd is not None and isinstance(obj, pd.DataFrame):
+            return _frame_fingerprint(obj)
+        if pd is not None and isinstance(obj, pd.Series):
+            return _series_fingerprint(obj)
+    except (_NotCanonical, TypeError, ValueError):  # e.g. lists, mixed types
+        return obj
+    if pa is not None and isinstance(
+            obj, (pa.Table, pa.ChunkedArray, pa.Array)):
+        return _arrow_fingerprint(obj)
+    return obj
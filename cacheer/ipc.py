@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Framing of messages over Unix sockets
+
+A frame is a fixed header (op, key length, payload length) followed by the
+key and the payload. Payloads are sent part by part when given as a list
+(e.g. `serializer.Chunks`), so serialized values are never joined first.
+"""
+
+import os
+import socket
+import struct
+
+FRAME = struct.Struct('<BIQ')
+
+
+class ConnectionClosed(ConnectionError):
+    pass
+
+
+def send_frame(sock, op, key=b'', payload=b''):
+    if isinstance(key, str):
+        key = key.encode()
+    if isinstance(payload, list):
+        parts = payload
+        length = sum(memoryview(p).nbytes for p in parts)
+    else:
+        parts = [payload]
+        length = memoryview(payload).nbytes
+    sock.sendall(FRAME.pack(op, len(key), length) + key)
+    for part in parts:
+        sock.sendall(part)
+
+
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionClosed
+        view = view[received:]
+    return buf
+
+
+def recv_frame(sock):
+    """
+    (op, key, payload) of the next frame, payload being a bytearray
+    """
+    op, key_len, length = FRAME.unpack(recv_exact(sock, FRAME.size))
+    key = recv_exact(sock, key_len).decode() if key_len else ''
+    payload = recv_exact(sock, length) if length else b''
+    return op, key, payload
+
+
+def connect(path, timeout=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def listen(path, backlog=128):
+    """
+    Unix socket bound to `path`, replacing a stale socket file left there
+    """
+    if os.path.exists(path):
+        try:
+            connect(path, timeout=1).close()
+        except OSError:
+            os.unlink(path)
+        else:
+            raise RuntimeError('{} is already served'.format(path))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(backlog)
+    return sock
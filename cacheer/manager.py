@@ -6,20 +6,42 @@ import time
 import inspect
 import functools
 import collections
+import threading
 import __main__
-from pandas.io.pickle import pkl
+import pickle
 import hashlib
 import contextlib
 
 import logging
-from concurrent.futures import ThreadPoolExecutor
 
-from cacheer.store import SqliteCacheStore as Store, MongoMetaDB as MetaDB
-from cacheer.serializer import serializer
-from cacheer.utils import timeit, is_defined_in_shell, get_mp_logger
+from cacheer.store import (open_cache_store, IdleCompactor,
+                           MongoMetaDB as MetaDB)
+from cacheer.serializer import serializer, project, Chunks
+from cacheer.writer import WriteQueue, WriterClientStore
+from cacheer.quota import ApiQuota, ValueRefs
+from cacheer.fingerprint import fingerprint, content_hash
+from cacheer import ranges, tracing
+from cacheer.utils import (timeit, is_defined_in_shell, get_mp_logger,
+                           ArgRepr, LogSampler, after_fork)
 from cacheer.settings import conf
 
-LOG = get_mp_logger(conf['logging'], 'cacheer.manager')
+LOG = logging.getLogger('cacheer.manager')
+
+_logging_ready = False
+_logging_lock = threading.Lock()
+
+
+def setup_logging():
+    """
+    Apply logging config, deferred to the first use of a cache manager
+    """
+    global _logging_ready
+    with _logging_lock:
+        if not _logging_ready:
+            get_mp_logger(conf.get('logging'), 'cacheer.manager',
+                          mode=conf.get('log-mode', 'mp'))
+            _logging_ready = True
+
 
 BASE_BLOCK_ID = '${api-fullname}'
 
@@ -41,6 +63,12 @@ class OriginalCallFailure(Exception):
         super().__init__(*args, **kw)
 
 
+class NegativeCacheHit(OriginalCallFailure):
+    """
+    Failure of an earlier call with the same arguments, replayed from cache
+    """
+
+
 def gen_cache_key(func, *args, **kw):
 
     # func has yet to get its __self__ attr
@@ -69,6 +97,8 @@ def gen_cache_key(func, *args, **kw):
 
         return True
 
+    key_func = getattr(func, '_key_func', None)
+
     signature = inspect.signature(func)
 
     bound_arg = signature.bind(*args, **kw)
@@ -87,9 +117,22 @@ def gen_cache_key(func, *args, **kw):
                 v_ = v.replace('&self', 'owner')
                 meta[k] = eval(v_)
 
+    if key_func is not None:
+        arg = collections.OrderedDict(__key=key_func(*args, **kw))
+
     arg.update({'__api_meta': meta})
 
-    key = hashlib.md5(pkl.dumps(arg, pkl.HIGHEST_PROTOCOL)).hexdigest()
+    # large arrays/frames are hashed in place rather than pickled, keys of
+    # other calls stay as they were
+    key_arg = arg
+    for k, v in arg.items():
+        fp = fingerprint(v)
+        if fp is not v:
+            if key_arg is arg:
+                key_arg = arg.copy()
+            key_arg[k] = fp
+    key = hashlib.md5(
+        pickle.dumps(key_arg, pickle.HIGHEST_PROTOCOL)).hexdigest()
 
     return key, arg
 
@@ -98,14 +141,71 @@ class Cache:
     token = ''
     hash = ''
     value = ''
+    api = None
+    cost = None  # seconds it took to compute
+    content = None  # content_hash of the value, if it has one
+    extra = None  # additional meta fields
+
+
+class DeltaRecord:
+    """
+    Stored value made of the rows appended to the value stored under `base`
+
+    `depth` counts the records down to a full copy.
+    """
+
+    def __init__(self, base, delta, depth):
+        self.base = base
+        self.delta = delta
+        self.depth = depth
+
+
+def _approx_size(value):
+    # memory held by a value waiting to be written
+    if isinstance(value, DeltaRecord):
+        return _approx_size(value.delta)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, Chunks):
+        return value.nbytes
+    pd = sys.modules.get('pandas')
+    if pd is not None and isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if pd is not None and isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    nbytes = getattr(value, 'nbytes', None)  # numpy arrays, arrow tables
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+def _is_empty(value):
+    # None, or a value of zero length
+    if value is None:
+        return True
+    try:
+        return len(value) == 0
+    except TypeError:
+        return False
+
+
+def _nrows(value):
+    pd = sys.modules.get('pandas')
+    if pd is not None and isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
 
 
 class CacheManager:
 
-    def __init__(self, cache_store, metadb):
+    def __init__(self, cache_store=None, metadb=None):
         # TODO: implement CacheStore over LmdbStore
-        self._cache_store = cache_store
-        self._metadb = metadb
+        # backends default to the configured ones, built on first use
+        self._cache_store_inst = cache_store
+        self._metadb_inst = metadb
+        self._init_lock = threading.Lock()
+        self._ready = False
+        after_fork(self, '_after_fork')
 
         self._mark_as_outdated = False
 
@@ -114,20 +214,132 @@ class CacheManager:
         self.enable_cache()
 
         self._allow_background_workers = True
-        self._background_workers = ThreadPoolExecutor(
-            max_workers=4, thread_name_prefix='CacheWriter')
+        self._background_workers = WriteQueue(
+            max_workers=4, name='CacheWriter')
+
+        # api name -> ApiQuota, of APIs declaring storage limits
+        self._quotas = {}
+        # metas referring to each stored value, for values to be deleted
+        # once unreferenced
+        self._value_refs = ValueRefs()
+
+        # traces cached calls once given an exporter
+        self.tracer = tracing.Tracer()
+
+        self._compactor = None
 
     def __call__(self, *args, **kw):
         return self.cache(*args, **kw)
+
+    def _setup(self):
+        # logging and config dependent state, deferred to first use
+        if self._ready:
+            return
+        setup_logging()
+        self._log_sampler = LogSampler(conf.get('log-sampling'))
+        self._log_arg_length = conf.get('log-arg-length', 200)
+        self._delta_max_depth = conf.get('delta-max-depth', 20)
+        self._min_benefit = conf.get('admission-min-benefit')
+
+        workers = self._background_workers
+        workers.max_bytes = conf.get('write-queue-max-bytes',
+                                     workers.max_bytes)
+        workers.policy = conf.get('write-queue-policy', workers.policy)
+        workers.exit_timeout = conf.get('write-queue-exit-timeout')
+        tracing.configure(self.tracer, conf.get('tracing'))
+        self._ready = True
+
+    @property
+    def _cache_store(self):
+        if self._cache_store_inst is None:
+            with self._init_lock:
+                if self._cache_store_inst is None:
+                    self._setup()
+                    self._cache_store_inst = open_cache_store()
+        return self._cache_store_inst
+
+    def _touch_compactor(self):
+        # free pages are reclaimed once writes pause, by a writer daemon
+        # rather than its clients
+        if self._compactor is None:
+            store = self._cache_store
+            interval = conf.get('sqlite-vacuum-interval', 60)
+            if not (interval and hasattr(store, 'incremental_vacuum')) or \
+                    isinstance(store, WriterClientStore):
+                self._compactor = False
+            else:
+                self._compactor = IdleCompactor(store, interval)
+        if self._compactor:
+            self._compactor.touch()
+
+    @property
+    def _metadb(self):
+        if self._metadb_inst is None:
+            with self._init_lock:
+                if self._metadb_inst is None:
+                    self._setup()
+                    self._metadb_inst = MetaDB()
+        return self._metadb_inst
     
-    def run_in_background(self, task, *args, **kw):
+    def run_in_background(self, task, *args, key=None, size=0, **kw):
+        """
+        Run `task` in a writer thread, replacing a pending task of the same
+        `key`, `size` being the bytes it holds on to
+        """
         if self._allow_background_workers:
-            LOG.info(f'Run `{task.__name__}` in background')
-            self._background_workers.submit(
-                task, *args, **kw)
+            LOG.debug('Run `%s` in background', task.__name__)
+            if args or kw:
+                task = functools.partial(task, *args, **kw)
+            with tracing.span('enqueue'):
+                self._background_workers.submit(task, key=key, size=size)
         else:
             task(*args, **kw)
 
+    def flush(self, timeout=None):
+        """
+        Wait for background cache writes to finish, and to be applied by
+        the writer daemon or cache server if any, returning False if some
+        are still pending after `timeout` seconds
+        """
+        if not self._background_workers.flush(timeout):
+            return False
+        if isinstance(self._cache_store_inst, WriterClientStore):
+            self._cache_store_inst.sync()
+        return True
+
+    def prefork(self):
+        """
+        Set up config and logging, open the cache store and load the api
+        map and latest tokens of the meta db, before forking workers
+
+        Forked workers then serve their first calls warm, sharing all of it
+        copy-on-write. What doesn't survive fork (sqlite connections,
+        writer threads) is dropped in each child and recreated on use.
+        """
+        self._setup()
+        # a lookup opens the store, creating its tables if needed
+        self._cache_store.read_meta('')
+        metadb = self._metadb
+        if hasattr(metadb, 'preload'):
+            metadb.preload()
+
+    def _after_fork(self):
+        # the lock may have been held by another thread of the parent
+        self._init_lock = threading.Lock()
+
+    def _log_call(self, outcome, msg, api_name, key=None, api_arg=None):
+        # sampled per outcome, and only formatted if a handler emits it
+        if outcome != 'write':  # may run inline, in the calling thread
+            tracing.tag(outcome=outcome)
+        if not LOG.isEnabledFor(logging.INFO):
+            return
+        if not self._log_sampler.sample(outcome):
+            return
+        if api_arg is not None:
+            LOG.info('JPY_USER: %s, Request: %s, hash=%s', JPY_USER,
+                     ArgRepr(api_arg, self._log_arg_length), key)
+        LOG.info(msg, api_name)
+
     @classmethod
     def enable_cache(cls):
         os.environ['USE_LAB_CACHE'] = 'true'
@@ -223,40 +435,67 @@ class CacheManager:
         return self._metadb.get_latest_token(block_id)
 
     def _get_all_keys(self):
-        # FIXME: only valid with SqliteCacheStore
-        res = self._cache_store._store.read_distinct(['key'])
-        return [i['key'] for i in res]
+        return self._cache_store.keys()
 
     def _has_key(self, key):
         return self._cache_store.has_key(key)
 
+    def _write_meta(self, key, meta):
+        self._cache_store.write_meta(key, meta)
+        self._value_refs.update(key, meta)
+
+    def _delete_meta(self, key):
+        self._cache_store.delete_meta(key)
+        self._value_refs.remove(key)
+
     def write_cache(self, key, cache):
 
         # TODO: remove expired cache value only when limit is about to be hit
 
         # write cache meta
-        cache_meta = self.read_cache_meta()
-
-        has_value = cache.hash in [v['hash'] for v in cache_meta.values()]
-
         meta = {
             'key': key,
             'token': cache.token,
-            'hash': cache.hash
+            'hash': cache.hash,
+            'api': cache.api,
+            'size': _approx_size(cache.value),
+            'time': time.time(),
+            'cost': cache.cost
         }
-        self._cache_store.write_meta(key, meta)
+        if cache.content is not None:
+            meta['content'] = cache.content
+        if cache.extra:
+            meta.update(cache.extra)
+        self._write_meta(key, meta)
 
         # value_stored = cache.hash in self._get_all_keys()
         value_stored = self._has_key(cache.hash)
 
-        if has_value or value_stored:
-            LOG.info('{}: cache value already exists or is being created'
-                     .format(key))
+        # a lookup of this hash only, scanning all meta would visit every
+        # shard of a sharded store
+        if value_stored:
+            self._log_call('write', '%s: cache value already exists', key)
         else:
             self._cache_store.write(cache.hash, cache.value)
-            LOG.info('{}: cache written'.format(key))
+            self._log_call('write', '%s: cache written', key)
 
-        self.clear_expired()
+        quota = self._quotas.get(cache.api)
+        if quota is not None:
+            quota.add(self._cache_store, key, meta)
+
+        self._touch_compactor()
+
+    def _admit(self, cost, size, min_benefit=None):
+        """
+        Whether a value of `size` bytes that took `cost` seconds to compute
+        saves at least `min_benefit` compute seconds per MB stored, by
+        default `admission-min-benefit`
+        """
+        if min_benefit is None:
+            min_benefit = self._min_benefit
+        if not min_benefit:
+            return True
+        return cost >= min_benefit * size / 1024 ** 2
 
     def read_cache_meta(self, key=None):
         if key is None:
@@ -275,7 +514,7 @@ class CacheManager:
             return None
         return meta['hash']
 
-    def read_cache_value(self, key, meta=None):
+    def read_cache_value(self, key, meta=None, columns=None, filter=None):
         if meta is None:
             meta = self.read_cache_meta(key)
         cache_key = meta['hash']
@@ -287,40 +526,179 @@ class CacheManager:
 
         # if cache_key not in self._get_all_keys():
         if not self._has_key(cache_key):
-            LOG.warning(f'{key}: fail to retrieve cache value')
+            LOG.warning('%s: fail to retrieve cache value', key)
             if 'failure_time' not in meta:
                 meta['failure_time'] = time.time()
-                self._cache_store.write_meta(key, meta)
+                self._write_meta(key, meta)
             else:
                 if time.time() - meta['failure_time'] > 600:
-                    self._cache_store.delete_meta(key)
-                    LOG.warning(f'{key}: cache corrupted, would be removed')
+                    self._delete_meta(key)
+                    LOG.warning('%s: cache corrupted, would be removed', key)
                     raise CacheCorrupted
             raise CacheDataNotFound
 
-        cache_value = self._cache_store.read(cache_key)
+        if meta.get('delta'):
+            with tracing.span('read'):
+                cache_value = self._read_delta(cache_key)
+            if columns is not None or filter is not None:
+                cache_value = project(cache_value, columns=columns,
+                                      filter=filter)
+        elif columns is None and filter is None:
+            cache_value = self._read_value(cache_key)
+            if isinstance(cache_value, DeltaRecord):
+                cache_value = self._read_delta(cache_key)
+        elif hasattr(self._cache_store, 'read_partial'):
+            try:
+                with tracing.span('read'):
+                    cache_value = self._cache_store.read_partial(
+                        cache_key, columns=columns, filter=filter)
+            except TypeError:
+                # not a table, e.g. a delta record stored by an earlier
+                # version under the hash of a full value
+                cache_value = project(self._read_delta(cache_key),
+                                      columns=columns, filter=filter)
+        else:
+            # delta records resolved, whatever the meta says
+            with tracing.span('read'):
+                cache_value = self._read_delta(cache_key)
+            cache_value = project(cache_value, columns=columns, filter=filter)
         if cache_value is None:
             if not serializer.gen_md5(cache_value) == cache_key:
-                LOG.warning(f'{key}; cache value might be lost for a db reset')
+                LOG.warning('%s; cache value might be lost for a db reset',
+                            key)
                 raise CacheDataNotFound
 
-        LOG.info(f'{key}: cache loaded')
+        LOG.debug('%s: cache loaded', key)
         return cache_value
 
+    def _read_value(self, cache_key):
+        store = self._cache_store
+        if not tracing.active() or not hasattr(store, 'read_raw'):
+            return store.read(cache_key)
+        # traced calls time reading and deserializing apart
+        with tracing.span('read'):
+            b_value = store.read_raw(cache_key)
+        if b_value is None:
+            return None
+        with tracing.span('deserialize'):
+            return serializer.deserialize(b_value)
+
+    def _read_delta(self, cache_key):
+        # follow delta records down to the full copy, then append the deltas
+        import pandas as pd
+
+        deltas = []
+        value = self._cache_store.read(cache_key)
+        while isinstance(value, DeltaRecord):
+            deltas.append(value.delta)
+            if not self._has_key(value.base):
+                LOG.warning('%s: base of delta record lost', cache_key)
+                raise CacheDataNotFound
+            value = self._cache_store.read(value.base)
+        if not deltas:
+            return value
+        return pd.concat([value] + deltas[::-1])
+
+    def _set_delta(self, cache, prev_meta, new_value, append_only):
+        """
+        Make `cache` store only the rows `new_value` appends to the
+        previous value, unless it's time for a full copy
+        """
+        nrows = _nrows(new_value)
+        if nrows is None:
+            return
+        cache.extra = {'nrows': nrows}
+
+        prev_nrows = prev_meta.get('nrows')
+        depth = prev_meta.get('delta', 0) + 1
+        if prev_nrows is None or not 0 < prev_nrows < nrows:
+            return
+        if depth > self._delta_max_depth:  # compact
+            return
+        prev_hash = prev_meta.get('value_hash', prev_meta['hash'])
+        if append_only == 'detect':
+            prefix = new_value.iloc[:prev_nrows]
+            prefix_content = None
+            if prev_meta.get('content') is not None:
+                prefix_content = content_hash(prefix)
+            if prefix_content is not None:
+                appended = prefix_content == prev_meta['content']
+            else:
+                appended = serializer.gen_md5(prefix) == prev_hash
+            if not appended:
+                return
+
+        # stored under its own hash, as the hash of the full value may also
+        # be that of a full copy, e.g. stored by another entry; meta keeps
+        # the full value's for comparisons
+        record = DeltaRecord(
+            prev_meta['hash'], new_value.iloc[prev_nrows:], depth)
+        cache.extra['value_hash'] = cache.hash
+        cache.hash, cache.value = serializer.gen_md5(record, value=True)
+        cache.extra['delta'] = depth
+        # values down the chain, for them not to be deleted while in use
+        cache.extra['bases'] = [prev_meta['hash']] + list(
+            prev_meta.get('bases') or [])
+
+    def write_negative(self, key, token, exc=None, value=None, api=None):
+        """
+        Remember that the call cached under `key` raised `exc`, or returned
+        the empty `value`, as of `token`
+        """
+        negative = {'time': time.time()}
+        if exc is not None:
+            exc_type = type(exc)
+            negative['type'] = exc_type.__module__ + '.' + exc_type.__qualname__
+            negative['message'] = str(exc)
+            try:
+                negative['exc'] = pickle.dumps(exc, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                pass
+        else:
+            negative['value'] = value
+        self._write_meta(
+            key, {'key': key, 'token': token, 'hash': '', 'api': api,
+                  'time': negative['time'], 'negative': negative})
+        self._log_call('write', '%s: negative cache written', key)
+
+    @staticmethod
+    def _replay_negative(negative):
+        if 'type' not in negative:
+            return negative.get('value')
+        exc = None
+        if 'exc' in negative:
+            try:
+                exc = pickle.loads(negative['exc'])
+            except Exception:
+                pass
+        if exc is None:  # not picklable, or its class is gone
+            exc = RuntimeError('{}: {}'.format(negative['type'],
+                                               negative['message']))
+        raise NegativeCacheHit(exc)
+
     def update_cache_meta(self, key, meta):
-        self._cache_store.write_meta(key, meta)
+        self._write_meta(key, meta)
 
     def delete_cache(self, key):
 
         # logically delete cache
-        self._cache_store.delete_meta(key)
+        self._delete_meta(key)
         # TODO: remove expired
 
-    def clear_expired(self):
-        pass
+    def clear_expired(self, api_name=None):
+        """
+        Evict entries past the ttl or limits of their API, of all APIs
+        declaring some by default
+        """
+        if api_name is not None:
+            quotas = [self._quotas[api_name]]
+        else:
+            quotas = list(self._quotas.values())
+        for quota in quotas:
+            quota.enforce(self._cache_store)
 
     def _remove_corrupted_cache(self, key):
-        self._cache_store.delete_meta(key)
+        self._delete_meta(key)
 
     def _parse_key_as_params(self, key):
         """
@@ -328,7 +706,165 @@ class CacheManager:
             {class_name}_{class_signature}_{method_name}_{arguments}
         """
 
-    def cache(self, block_id=BASE_BLOCK_ID, api_meta={}):
+    def _range_call(self, func, api_name, range_args, range_index,
+                    args, kw):
+        """
+        Serve a call from cached range segments, calling `func` only over
+        sub-ranges not cached yet
+        """
+        start_arg, end_arg = range_args
+        bound = inspect.signature(func).bind(*args, **kw)
+        bound.apply_defaults()
+        start = bound.arguments[start_arg]
+        end = bound.arguments[end_arg]
+
+        # segments are shared by all ranges of otherwise equal arguments
+        bound.arguments[start_arg] = bound.arguments[end_arg] = None
+        key, api_arg = gen_cache_key(func, *bound.args, **bound.kwargs)
+        key += ':range'
+
+        def _call(sub_start, sub_end):
+            bound.arguments[start_arg] = sub_start
+            bound.arguments[end_arg] = sub_end
+            try:
+                with tracing.span('compute'):
+                    return func(*bound.args, **bound.kwargs)
+            except Exception as e:
+                raise OriginalCallFailure(e)
+
+        latest_token = self.get_latest_token(api_name)
+        if latest_token is None:
+            self._log_call('unregistered',
+                           '%s: fail to find upstream status in metadb',
+                           api_name, key, api_arg)
+            return _call(start, end)
+
+        cache_meta = self.read_cache_meta(key) or {}
+        segments = cache_meta.get('segments', [])
+        token = cache_meta.get('token')
+        if token is None or token < latest_token or self._mark_as_outdated:
+            segments = []
+
+        touched = ranges.overlapping(segments, start, end)
+        parts = []
+        for seg_start, seg_end, seg_hash in touched:
+            if not self._has_key(seg_hash):
+                LOG.warning('%s: fail to retrieve range segment', key)
+                segments, touched, parts = [], [], []
+                break
+            parts.append(self._cache_store.read(seg_hash))
+
+        gaps = ranges.missing_ranges(segments, start, end)
+
+        if not gaps:
+            self._log_call('hit', '%s: range cache hit',
+                           api_name, key, api_arg)
+            return ranges.select_range(
+                ranges.stitch(parts, range_index), start, end, range_index)
+
+        new_parts = []
+        for sub_start, sub_end, include_start, include_end in gaps:
+            new_parts.append(ranges.select_range(
+                _call(sub_start, sub_end), sub_start, sub_end, range_index,
+                include_start=include_start, include_end=include_end))
+
+        merged = ranges.stitch(parts + new_parts, range_index)
+        bounds = [b for seg in touched for b in seg[:2]] + [start, end]
+        segment = (min(bounds, key=ranges.coerce_bound),
+                   max(bounds, key=ranges.coerce_bound))
+
+        self._log_call('miss', '%s: {} missing sub-range(s) computed, '
+                       'return stitched value and write segment'.format(
+                           len(gaps)),
+                       api_name, key, api_arg)
+
+        def _write_segment():
+            seg_hash, seg_value = serializer.gen_md5(merged, value=True)
+            if not self._has_key(seg_hash):
+                self._cache_store.write(seg_hash, seg_value)
+            # merge into segments written since this call read them
+            meta = self.read_cache_meta(key) or {}
+            previous = {s[2] for s in meta.get('segments') or ()}
+            if meta.get('token') != latest_token:
+                meta = {'key': key, 'token': latest_token, 'hash': '',
+                        'segments': []}
+            meta['segments'] = ranges.merge_segments(
+                meta['segments'], segment + (seg_hash,))
+            self._write_meta(key, meta)
+            self._log_call('write', '%s: range segment written', key)
+
+            # values of the segments merged into this one, or outdated
+            superseded = previous - {s[2] for s in meta['segments']}
+            if superseded:
+                self._value_refs.delete_unreferenced(self._cache_store,
+                                                     superseded)
+
+        self.run_in_background(_write_segment, size=_approx_size(merged))
+
+        return ranges.select_range(merged, start, end, range_index)
+
+    def cache(self, block_id=BASE_BLOCK_ID, api_meta={}, range_args=None,
+              range_index=None, append_only=False, negative_ttl=None,
+              negative_errors=(Exception,), negative_empty=None,
+              max_bytes=None, max_entries=None, ttl=None, min_benefit=None,
+              key=None):
+        """
+        Parameters
+        ----------
+        block_id: `str`
+            数据块标签
+        api_meta: `dict`
+            extra fields of the cache key
+        range_args: `tuple`
+            names of the (start, end) arguments of a function returning a
+            DataFrame/Series over that range, ends included. Results are
+            then cached as segments and a call only computes the sub-ranges
+            not cached yet. Calls with either end None are cached as usual
+        range_index: `str`
+            index level or column holding the range dimension, the first
+            index level by default
+        append_only: `bool` or 'detect'
+            whether updates of the returned DataFrame/Series only append
+            rows. If True, an updated value is stored as the rows appended
+            to the previous one; with 'detect', only once its leading rows
+            are checked to hash as the previous value. A full copy is
+            stored again every `delta-max-depth` updates
+        negative_ttl: `float`
+            seconds for which a call raising one of `negative_errors`, or
+            returning an empty result, is remembered: calls with the same
+            arguments then raise the same exception, or return the same
+            result, without calling the function, until that or a source
+            update. Failures aren't remembered by default
+        negative_errors: `tuple`
+            exception types remembered, all by default
+        negative_empty: `bool` or callable
+            whether empty results, None or of zero length by default, are
+            remembered for `negative_ttl` only, rather than cached as usual
+        max_bytes: `int`
+            bytes of values the API's entries may hold, its oldest entries
+            being evicted past that
+        max_entries: `int`
+            entries the API may hold, likewise
+        ttl: `float`
+            seconds after which an entry is computed again, even if its
+            source wasn't updated
+        min_benefit: `float`
+            compute seconds a result should save per MB stored to be
+            cached, `admission-min-benefit` by default. Results faster to
+            compute again than that aren't written
+        key: callable
+            takes the function's arguments and returns what identifies a
+            call in place of them, e.g. `lambda df, n: (df.attrs['id'], n)`
+        """
+        if range_args is not None and len(range_args) != 2:
+            raise ValueError('range_args should be (start, end) '
+                             'argument names')
+
+        is_empty = None
+        if negative_ttl is not None and negative_empty:
+            is_empty = negative_empty if callable(negative_empty) \
+                else _is_empty
+
         def _cache(func):
 
             api_name = func.__module__ + '.' + func.__qualname__
@@ -352,10 +888,25 @@ class CacheManager:
 
             func._api_meta = {'__api_name': api_name}
             func._api_meta.update(api_meta)
+            func._key_func = key
 
             if self._auto_register_api:
                 self.register_api(api_name, block_id)
 
+            quota = None
+            if max_bytes is not None or max_entries is not None or \
+                    ttl is not None:
+                quota = self._quotas[api_name] = ApiQuota(
+                    api_name, max_bytes=max_bytes, max_entries=max_entries,
+                    ttl=ttl, refs=self._value_refs)
+
+            if range_args is not None:
+                params = inspect.signature(func).parameters
+                for arg in range_args:
+                    if arg not in params:
+                        raise ValueError('{}: no argument named `{}`'.format(
+                            api_name, arg))
+
             @functools.wraps(func)
             def wrapper(*args, **kw):
 
@@ -366,48 +917,119 @@ class CacheManager:
                     except:
                         raise
 
+                self._setup()
+
+                trace = self.tracer.start(api_name)
+                if trace is None:
+                    return _cached_call(*args, **kw)
+                with trace:
+                    return _cached_call(*args, **kw)
+
+            def _cached_call(*args, **kw):
+                key = latest_token = None
                 try:
 
-                    key, api_arg = gen_cache_key(func, *args, **kw)
-                    LOG.info('JPY_USER: {}, Request: {}, hash={}'.format(
-                        JPY_USER, api_arg, key))
+                    if range_args is not None:
+                        bound = inspect.signature(func).bind(*args, **kw)
+                        bound.apply_defaults()
+                        if not any(bound.arguments[i] is None
+                                   for i in range_args):
+                            return self._range_call(
+                                func, api_name, range_args, range_index,
+                                args, kw)
+
+                    with tracing.span('key'):
+                        key, api_arg = gen_cache_key(func, *args, **kw)
+                    tracing.tag(key=key)
 
-                    latest_token = self.get_latest_token(api_name)
+                    with tracing.span('token'):
+                        latest_token = self.get_latest_token(api_name)
 
-                    cache_meta = self.read_cache_meta(key) or {}
+                    with tracing.span('meta'):
+                        cache_meta = self.read_cache_meta(key) or {}
                     token = cache_meta.get('token')
 
                     # case 0: api not registered, hence cannot retrive
                     # latest token
                     # TODO: to be removed
                     if latest_token is None:
-                        LOG.info('{}: fail to find upstream status in metadb'
-                                 .format(api_name))
+                        self._log_call(
+                            'unregistered',
+                            '%s: fail to find upstream status in metadb',
+                            api_name, key, api_arg)
 
                         try:
-                            return func(*args, **kw)
+                            with tracing.span('compute'):
+                                return func(*args, **kw)
                         except Exception as e:
                             raise OriginalCallFailure(e)
 
+                    # negative cache: failure or empty result remembered
+                    negative = cache_meta.get('negative')
+                    if negative is not None:
+                        if (negative_ttl is not None and
+                                token >= latest_token and
+                                not self._mark_as_outdated and
+                                time.time() - negative['time'] <
+                                negative_ttl):
+                            self._log_call(
+                                'negative', '%s: negative cache hit',
+                                api_name, key, api_arg)
+                            return self._replay_negative(negative)
+                        token = None
+
+                    # past the API's ttl
+                    if quota is not None and quota.expired(cache_meta):
+                        token = None
+
                     # case 1: cache not found
                     if token is None:
 
+                        started = time.perf_counter()
                         try:
-                            new_value = func(*args, **kw)
+                            with tracing.span('compute'):
+                                new_value = func(*args, **kw)
                         except Exception as e:
                             raise OriginalCallFailure(e)
+                        cost = time.perf_counter() - started
 
-                        LOG.info('{}: cache not found, return new value '
-                                 'and write cache'.format(api_name))
+                        if is_empty is not None and is_empty(new_value):
+                            self.run_in_background(
+                                self.write_negative, key, latest_token,
+                                key=key, value=new_value, api=api_name)
+                            return new_value
+
+                        value_size = _approx_size(new_value)
+                        if not self._admit(cost, value_size, min_benefit):
+                            self._log_call(
+                                'skipped', '%s: cheap to compute, cache not '
+                                'written', api_name, key, api_arg)
+                            return new_value
+
+                        self._log_call(
+                            'miss', '%s: cache not found, return new value '
+                            'and write cache', api_name, key, api_arg)
 
                         def _write_new_cache():
                             cache = Cache()
                             cache.token = latest_token
+                            cache.api = api_name
+                            cache.cost = cost
+                            cache.content = content_hash(new_value)
                             cache.hash, cache.value = serializer.gen_md5(
                                 new_value, value=True)
+                            # serialized size may differ from memory's
+                            if not self._admit(cost, _approx_size(cache.value),
+                                               min_benefit):
+                                return
+                            if append_only:
+                                nrows = _nrows(new_value)
+                                if nrows is not None:
+                                    cache.extra = {'nrows': nrows}
                             self.write_cache(key, cache)
                         
-                        self.run_in_background(_write_new_cache)
+                        self.run_in_background(
+                            _write_new_cache, key=key, size=value_size)
 
                         return new_value
 
@@ -415,71 +1037,179 @@ class CacheManager:
                     if token < latest_token or self._mark_as_outdated:
 
                         # cache_value = self.read_cache_value(key)
-                        cache_hash = cache_meta['hash']
+                        # of the full value, for delta records
+                        cache_hash = cache_meta.get('value_hash',
+                                                    cache_meta['hash'])
 
+                        started = time.perf_counter()
                         try:
-                            new_value = func(*args, **kw)
+                            with tracing.span('compute'):
+                                new_value = func(*args, **kw)
                         except Exception as e:
                             raise OriginalCallFailure(e)
+                        cost = time.perf_counter() - started
+
+                        if is_empty is not None and is_empty(new_value):
+                            self.run_in_background(
+                                self.write_negative, key, latest_token,
+                                key=key, value=new_value, api=api_name)
+                            return new_value
+
+                        if not self._admit(cost, _approx_size(new_value),
+                                           min_benefit):
+                            self._log_call(
+                                'skipped', '%s: cheap to compute, cache not '
+                                'written', api_name, key, api_arg)
+                            return new_value
 
-                        new_value_hash, new_value_bytes = serializer.gen_md5(
-                            new_value, value=True)
+                        # values with a content hash are compared without
+                        # serializing them, others by their serialized bytes
+                        with tracing.span('hash'):
+                            new_content = content_hash(new_value)
+                        unchanged = new_content is not None and \
+                            new_content == cache_meta.get('content')
+                        if not unchanged:
+                            with tracing.span('serialize'):
+                                new_value_hash, new_value_bytes = \
+                                    serializer.gen_md5(new_value, value=True)
+                            unchanged = cache_hash == new_value_hash
 
                         # case 2.1: value unchanged, only update token
                         # if self.compare_equal(cache_value, new_value):
-                        if cache_hash == new_value_hash:
+                        if unchanged:
                             cache_meta['token'] = latest_token
+                            cache_meta['time'] = time.time()
+                            if new_content is not None:
+                                cache_meta['content'] = new_content
                             self.update_cache_meta(key, cache_meta)
-                            LOG.info('{}: value unchanged, '
-                                     'only update token'.format(api_name))
+                            self._log_call(
+                                'unchanged',
+                                '%s: value unchanged, only update token',
+                                api_name, key, api_arg)
                             return new_value
 
                         # case 2.2: value changed, update cache
                         else:
 
+                            if not self._admit(
+                                    cost, _approx_size(new_value_bytes),
+                                    min_benefit):
+                                self._log_call(
+                                    'skipped', '%s: cheap to compute, cache '
+                                    'not written', api_name, key, api_arg)
+                                return new_value
+
                             def _overwrite_cache():
                                 cache = Cache()
                                 cache.token = latest_token
+                                cache.api = api_name
+                                cache.cost = cost
                                 cache.value = new_value_bytes
                                 cache.hash = new_value_hash
+                                cache.content = new_content
+                                if append_only:
+                                    self._set_delta(cache, cache_meta,
+                                                    new_value, append_only)
                                 self.write_cache(key, cache)
                             
-                            self.run_in_background(_overwrite_cache)
-
-                            LOG.info('{}: cache overwritten'.format(api_name))
+                            size = _approx_size(new_value_bytes)
+                            if append_only:
+                                size += _approx_size(new_value)
+                            self.run_in_background(
+                                _overwrite_cache, key=key, size=size)
+
+                            self._log_call(
+                                'overwritten', '%s: cache overwritten',
+                                api_name, key, api_arg)
                             return new_value
 
                     # case 3: token validated
                     if token >= latest_token:
-                        LOG.info('{}: cache hit'.format(api_name))
+                        self._log_call('hit', '%s: cache hit',
+                                       api_name, key, api_arg)
                         try:
                             return self.read_cache_value(key, meta=cache_meta)
                         except (CacheDataNotFound, CacheCorrupted):
 
                             try:
-                                ret = func(*args, **kw)
-                                LOG.info(f'{api_name}: skip cache')
+                                with tracing.span('compute'):
+                                    ret = func(*args, **kw)
+                                self._log_call('fallback',
+                                               '%s: skip cache', api_name)
                                 return ret
                             except Exception as e:
                                 raise OriginalCallFailure(e)
 
                 except OriginalCallFailure as e:
-                    LOG.info(f'{api_name}: original call failed')
+                    if isinstance(e, NegativeCacheHit):
+                        raise e.original_exc
+                    self._log_call('failure', '%s: original call failed',
+                                   api_name)
+                    if (negative_ttl is not None and key is not None and
+                            latest_token is not None and
+                            isinstance(e.original_exc, negative_errors)):
+                        self.run_in_background(
+                            self.write_negative, key, latest_token,
+                            key=key, exc=e.original_exc, api=api_name)
                     raise e.original_exc
                 except KeyboardInterrupt:
                     raise
                 except:
-                    LOG.error(f'{api_name}: cached call failed, '
-                              'fallback to original call', exc_info=True)
+                    LOG.error('%s: cached call failed, '
+                              'fallback to original call', api_name,
+                              exc_info=True)
                     try:
-                        self._remove_corrupted_cache(key)
+                        if key is not None:
+                            self._remove_corrupted_cache(key)
                     except:
                         LOG.error(
                             'Remove corrupted cache failed', exc_info=True)
-                    return func(*args, **kw)
+                    tracing.tag(outcome='error')
+                    with tracing.span('compute'):
+                        return func(*args, **kw)
+
+            def load(*args, columns=None, filter=None, **kw):
+                """
+                Return only `columns` and rows matching `filter` of the
+                DataFrame the function returns, read from cache when valid
+
+                `filter` is a list of (column, op, value) conditions, ANDed,
+                with op one of ==, !=, <, <=, >, >=, in, not in, or a
+                callable taking the frame and returning a boolean mask.
+                """
+                if self.is_using_cache() and not self._mark_as_outdated:
+                    self._setup()
+                    try:
+                        key, api_arg = gen_cache_key(func, *args, **kw)
+                        latest_token = self.get_latest_token(api_name)
+                        cache_meta = self.read_cache_meta(key) or {}
+                        token = cache_meta.get('token')
+                        if (latest_token is not None and token is not None
+                                and token >= latest_token
+                                and 'negative' not in cache_meta
+                                and not (quota is not None and
+                                         quota.expired(cache_meta))):
+                            ret = self.read_cache_value(
+                                key, meta=cache_meta, columns=columns,
+                                filter=filter)
+                            self._log_call('hit', '%s: partial cache hit',
+                                           api_name, key, api_arg)
+                            return ret
+                    except (CacheDataNotFound, CacheCorrupted):
+                        pass
+                    except KeyboardInterrupt:
+                        raise
+                    except:
+                        LOG.error('%s: partial cache load failed, fallback '
+                                  'to full call', api_name, exc_info=True)
+
+                return project(wrapper(*args, **kw),
+                               columns=columns, filter=filter)
+
+            wrapper.load = load
 
             return wrapper
         return _cache
 
 
-cache_manager = CacheManager(Store(), MetaDB())
+cache_manager = CacheManager()
@@ -5,6 +5,9 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+import os
+import copy
+import atexit
 import logging
 import multiprocessing
 import sys
@@ -36,6 +39,121 @@ def install_mp_handler(logger=None):
         logger.addHandler(handler)
 
 
+_shared_queue = None
+_shared_owner = None
+_shared_routes = {}
+_shared_listener = None
+
+
+def install_shared_queue_handler(logger=None):
+    """Routes the handlers reachable from the given Logger through one queue
+    shared by the whole process tree.
+
+    A single listener thread, in the process that first installs it, drains
+    the queue. Forked children inherit the queue and only enqueue records,
+    so no queue or thread is started per handler or per child process.
+    :param logger: whose handlers to route. By default, the root logger.
+    """
+    global _shared_queue, _shared_owner, _shared_listener
+
+    if logger is None:
+        logger = logging.getLogger()
+
+    if _shared_queue is None:
+        _shared_queue = multiprocessing.Queue(-1)
+        _shared_owner = os.getpid()
+        _shared_listener = threading.Thread(
+            target=_receive_shared, name='mp-shared-listener')
+        _shared_listener.daemon = True
+        _shared_listener.start()
+        atexit.register(_stop_shared_listener)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_reset_shared_queue)
+
+    if os.getpid() != _shared_owner:
+        # routes only live in the listener's process, handlers of loggers
+        # first configured in a child are left as they are
+        return
+
+    current = logger
+    while current is not None:
+        handlers = [h for h in current.handlers
+                    if not isinstance(h, SharedQueueHandler)]
+        if handlers:
+            _shared_routes.setdefault(current.name, []).extend(handlers)
+            for h in handlers:
+                current.removeHandler(h)
+            if not any(isinstance(h, SharedQueueHandler)
+                       for h in current.handlers):
+                current.addHandler(SharedQueueHandler(current.name))
+            for h in current.handlers:
+                if isinstance(h, SharedQueueHandler):
+                    h.setLevel(min(i.level for i in
+                                   _shared_routes[current.name]))
+        if not current.propagate:
+            break
+        current = current.parent
+
+
+def _receive_shared():
+    while True:
+        try:
+            record = _shared_queue.get()
+            if record is None:
+                break
+            for handler in _shared_routes.get(record.route, ()):
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except EOFError:
+            break
+        except:
+            traceback.print_exc(file=sys.stderr)
+
+
+def _reset_shared_queue():
+    # multiprocessing only resets a queue's feeder thread and locks in
+    # children it starts itself, do the same for plain os.fork
+    _shared_queue._after_fork()
+
+
+def _stop_shared_listener():
+    if os.getpid() == _shared_owner and _shared_listener.is_alive():
+        _shared_queue.put_nowait(None)
+        _shared_listener.join(5.0)  # Waits for the queue to empty.
+
+
+class SharedQueueHandler(logging.Handler):
+    """Enqueues records to the listener installed by
+    `install_shared_queue_handler`, tagged with the logger they are routed
+    to."""
+
+    def __init__(self, route):
+        super(SharedQueueHandler, self).__init__()
+        self.route = route
+
+    def emit(self, record):
+        try:
+            # stringify args and exc_info, as MultiProcessingHandler does,
+            # on a copy as the feeder thread pickles it later
+            record = copy.copy(record)
+            if record.args:
+                record.msg = record.getMessage()
+                record.args = None
+            if record.exc_info:
+                if not record.exc_text:
+                    record.exc_text = logging.Formatter().formatException(
+                        record.exc_info)
+                record.exc_info = None
+            record.route = self.route
+            _shared_queue.put_nowait(record)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
 class MultiProcessingHandler(logging.Handler):
 
     def __init__(self, name, sub_handler=None):
@@ -55,6 +173,10 @@ class MultiProcessingHandler(logging.Handler):
             target=self._receive, name=name)
         self._receive_thread.daemon = True
         self._receive_thread.start()
+        if hasattr(os, 'register_at_fork'):
+            # records of forked children go to the parent's receive thread,
+            # through a feeder thread of their own
+            os.register_at_fork(after_in_child=self.queue._after_fork)
 
     def setFormatter(self, fmt):
         super(MultiProcessingHandler, self).setFormatter(fmt)
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+"""
+Immutable pack files of cache entries
+
+A pack holds chosen entries of a cache (meta and values, as stored) in one
+file, for read-only consumers to memory-map: no locks, no transactions,
+and values are deserialized straight from the mapped pages.
+
+    python -m cacheer export-pack /shared/cache.pack --api some.api
+    python -m cacheer import-pack /shared/cache.pack
+
+Layout: a header, the values, each starting on a 64-byte boundary, their
+keys, then the index, one fixed-size record per entry sorted by the md5
+of its key, looked up by binary search. Meta is stored under its key
+prefixed with `__cache_meta_`, like in the sqlite stores.
+"""
+
+import os
+import mmap
+import time
+import struct
+import bisect
+import hashlib
+import logging
+
+from cacheer.serializer import serializer, Chunks
+from cacheer.settings import conf
+
+LOG = logging.getLogger('cacheer.manager')
+
+MAGIC = b'CACHEPK1'
+VERSION = 1
+# magic, version, entries, index offset, padded to the first value
+HEADER = struct.Struct('<8sIQQ36x')
+# key md5, value offset, value length, key offset, key length
+RECORD = struct.Struct('<16sQQQI4x')
+ALIGN = 64
+
+META_PREFIX = '__cache_meta_'
+
+
+def _digest(b_key):
+    return hashlib.md5(b_key).digest()
+
+
+def _parts(b_value):
+    if isinstance(b_value, Chunks):
+        return [memoryview(part).cast('B') for part in b_value]
+    return [memoryview(b_value).cast('B')]
+
+
+class PackWriter:
+    """
+    Writes a pack at `path`, in place once `close`d
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        self._f = open(self._tmp_path, 'wb')
+        self._f.write(bytes(HEADER.size))
+        self._offset = HEADER.size
+        self._entries = {}  # key -> (offset, length)
+
+    def add(self, key, b_value):
+        """
+        Add serialized value `b_value` under `key`, replacing an earlier
+        one of the same key
+        """
+        pad = -self._offset % ALIGN
+        self._f.write(bytes(pad))
+        offset = self._offset + pad
+        length = 0
+        for part in _parts(b_value):
+            self._f.write(part)
+            length += part.nbytes
+        self._offset = offset + length
+        self._entries[key] = (offset, length)
+
+    def add_meta(self, key, meta):
+        self.add(META_PREFIX + key, serializer.serialize(meta))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def close(self):
+        records = []
+        for key, (offset, length) in self._entries.items():
+            b_key = key.encode()
+            records.append((_digest(b_key), offset, length, b_key))
+        records.sort(key=lambda r: r[0])
+
+        index = []
+        for digest, offset, length, b_key in records:
+            self._f.write(b_key)
+            index.append(RECORD.pack(digest, offset, length, self._offset,
+                                     len(b_key)))
+            self._offset += len(b_key)
+        index_offset = self._offset
+        self._f.write(b''.join(index))
+
+        self._f.seek(0)
+        self._f.write(HEADER.pack(MAGIC, VERSION, len(records), index_offset))
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._f.close()
+        os.unlink(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class _Digests:
+    # key md5s of the index, as a sequence for bisect
+
+    def __init__(self, index, count):
+        self._index = index
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        start = i * RECORD.size
+        return bytes(self._index[start:start + 16])
+
+
+class PackStore(object):
+    """
+    Read-only cache store over the pack at `path`, `pack-uri` by default
+
+    Values read point into the mapped file where their codec allows it,
+    e.g. Arrow tables. Writes raise PermissionError; in `cache-tiers`, a
+    pack tier is skipped by writes and promotions.
+    """
+
+    read_only = True
+
+    def __init__(self, path=None):
+        self.path = path or conf['pack-uri']
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._mmap)
+
+        magic, version, count, index_offset = HEADER.unpack_from(self._buf)
+        if magic != MAGIC:
+            raise ValueError('{} is not a cache pack'.format(self.path))
+        if version > VERSION:
+            raise ValueError('{}: unsupported pack version {}'.format(
+                self.path, version))
+        self._count = count
+        self._index = self._buf[index_offset:
+                                index_offset + count * RECORD.size]
+        self._digests = _Digests(self._index, count)
+        self._cache_meta_prefix = META_PREFIX
+
+    def _records(self):
+        for i in range(self._count):
+            yield RECORD.unpack_from(self._index, i * RECORD.size)
+
+    def _key_of(self, record):
+        _, _, _, key_offset, key_len = record
+        return bytes(self._buf[key_offset:key_offset + key_len]).decode()
+
+    def _lookup(self, key):
+        b_key = key.encode()
+        digest = _digest(b_key)
+        i = bisect.bisect_left(self._digests, digest)
+        while i < self._count:
+            record = RECORD.unpack_from(self._index, i * RECORD.size)
+            if record[0] != digest:
+                break
+            _, offset, length, key_offset, key_len = record
+            if self._buf[key_offset:key_offset + key_len] == b_key:
+                return self._buf[offset:offset + length]
+            i += 1
+        return None
+
+    def read_raw(self, key):
+        """
+        Stored bytes of `key`, as a view of the mapped file
+        """
+        return self._lookup(key)
+
+    def read(self, key):
+        b_value = self._lookup(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize(b_value)
+
+    def read_partial(self, key, columns=None, filter=None):
+        b_value = self._lookup(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize_partial(
+            b_value, columns=columns, filter=filter)
+
+    def has_key(self, key):
+        return self._lookup(key) is not None
+
+    def keys(self):
+        keys = (self._key_of(record) for record in self._records())
+        return [k for k in keys if not k.startswith(META_PREFIX)]
+
+    def usage(self):
+        return sum(record[2] for record in self._records()
+                   if not self._key_of(record).startswith(META_PREFIX))
+
+    def read_meta(self, key):
+        b_meta = self._lookup(META_PREFIX + key)
+        if b_meta is None:
+            return None
+        return serializer.deserialize(b_meta)
+
+    def read_all_meta(self):
+        metas = {}
+        for record in self._records():
+            key = self._key_of(record)
+            if key.startswith(META_PREFIX):
+                _, offset, length, _, _ = record
+                metas[key] = serializer.deserialize(
+                    self._buf[offset:offset + length])
+        return metas
+
+    def _read_only(self, *args):
+        raise PermissionError('{} is read-only'.format(self.path))
+
+    write = write_meta = delete = delete_meta = write_batch = _read_only
+
+    def close(self):
+        # values read may still point into the map, which then closes
+        # once they are gone
+        self._index.release()
+        self._buf.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+
+def _value_keys(store, meta):
+    # the stored value of an entry, or its range segments, and the values
+    # its delta records are appended to
+    keys = [segment[2] for segment in meta.get('segments') or ()]
+    value_hash = meta.get('hash')
+    if not value_hash:
+        return keys
+    keys.append(value_hash)
+    if not meta.get('delta'):
+        return keys
+
+    from cacheer.manager import DeltaRecord
+
+    value = store.read(value_hash)
+    while isinstance(value, DeltaRecord):
+        keys.append(value.base)
+        value = store.read(value.base)
+    return keys
+
+
+def export_pack(store, path, apis=None, keys=None):
+    """
+    Write the entries of `store` of APIs `apis` and/or cache keys `keys`
+    (all by default) to a pack at `path`
+
+    Returns counts of entries and values written, the pack size and the
+    seconds taken.
+    """
+    started = time.time()
+    apis = set(apis) if apis else None
+    keys = set(keys) if keys else None
+
+    values = 0
+    with PackWriter(path) as writer:
+        for meta_key, meta in store.read_all_meta().items():
+            if not isinstance(meta, dict):
+                continue
+            key = meta_key[len(META_PREFIX):]
+            if apis is not None and meta.get('api') not in apis:
+                continue
+            if keys is not None and key not in keys:
+                continue
+            for value_key in _value_keys(store, meta):
+                if value_key in writer:
+                    continue
+                if hasattr(store, 'read_raw'):
+                    b_value = store.read_raw(value_key)
+                else:
+                    b_value = store.read(value_key)
+                    if b_value is not None:
+                        b_value = serializer.serialize(b_value)
+                if b_value is None:
+                    LOG.warning('%s: value %s lost, not exported', key,
+                                value_key)
+                    continue
+                writer.add(value_key, b_value)
+                values += 1
+            writer.add_meta(key, meta)
+        entries = len(writer) - values
+
+    LOG.info('%d entries exported to %s', entries, path)
+    return {'entries': entries, 'values': values,
+            'bytes': os.path.getsize(path),
+            'seconds': time.time() - started}
+
+
+def import_pack(path, store, batch_size=256, batch_bytes=64 * 1024 * 1024):
+    """
+    Write the entries of the pack at `path` to `store`, values it already
+    holds excepted, in batches of `batch_size` ops or `batch_bytes` bytes
+
+    Returns counts of entries and values written, and the seconds taken.
+    """
+    from cacheer.store import _write_batch
+
+    started = time.time()
+    pack = PackStore(path)
+    entries = values = 0
+    ops, size = [], 0
+    try:
+        for record in pack._records():
+            key = pack._key_of(record)
+            _, offset, length, _, _ = record
+            b_value = Chunks([pack._buf[offset:offset + length]])
+            if key.startswith(META_PREFIX):
+                ops.append(('write_meta', key[len(META_PREFIX):], b_value))
+                entries += 1
+            elif not store.has_key(key):
+                ops.append(('write', key, b_value))
+                values += 1
+            else:
+                continue
+            size += length
+            if len(ops) >= batch_size or size >= batch_bytes:
+                _write_batch(store, ops)
+                ops, size = [], 0
+        if ops:
+            _write_batch(store, ops)
+    finally:
+        pack.close()
+
+    LOG.info('%d entries imported from %s', entries, path)
+    return {'entries': entries, 'values': values,
+            'seconds': time.time() - started}
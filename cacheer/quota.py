@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+Storage quotas of cached APIs
+
+Entries are accounted per API from the `api`, `size` and `time` fields of
+their meta. Once an API holds more than its `max_bytes` or `max_entries`,
+its oldest entries are evicted, so that one API with high-cardinality
+arguments can't push out the entries of every other one. Entries older
+than `ttl` are evicted first.
+
+Among the oldest entries, those that took the least time to compute per
+byte (`cost` in meta) go first, as they are the cheapest to get back.
+
+Values are shared by entries of any API computing the same value, and by
+delta records and range segments; an evicted entry's values are only
+deleted once no meta in the store refers to them, as counted by `ValueRefs`.
+"""
+
+import time
+import logging
+import itertools
+import threading
+import collections
+
+LOG = logging.getLogger('cacheer.manager')
+
+
+def value_refs(meta):
+    """
+    Keys of the stored values the entry of `meta` reads, or None if they
+    aren't all known (delta entries written before meta listed bases)
+    """
+    refs = set()
+    if meta.get('hash'):
+        refs.add(meta['hash'])
+    bases = meta.get('bases') or ()
+    if len(bases) < meta.get('delta', 0):
+        return None
+    refs.update(bases)
+    refs.update(segment[2] for segment in meta.get('segments') or ())
+    return refs
+
+
+class ValueRefs:
+    """
+    Counts of the metas of a store referring to each stored value
+
+    Counted from all the metas of the store on first use, and again every
+    `refresh` seconds to pick up those written by other processes, or
+    whenever a quota reads them all; kept up to date in between with the
+    metas written and deleted through `update` and `remove`.
+    """
+
+    def __init__(self, refresh=300):
+        self.refresh = refresh
+
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        # meta key -> keys of the values it refers to
+        self._refs = {}
+        self._counts = collections.Counter()
+        # meta keys whose references aren't known
+        self._unknown = set()
+
+    def load(self, metas):
+        """
+        Count the references of `metas`, all the metas of the store by
+        their store keys
+        """
+        with self._lock:
+            self._refs.clear()
+            self._counts.clear()
+            self._unknown.clear()
+            for meta in metas.values():
+                if isinstance(meta, dict) and 'key' in meta:
+                    self._set(meta['key'], meta)
+            self._loaded_at = time.time()
+
+    def _drop(self, key):
+        refs = self._refs.pop(key, None)
+        if refs is not None:
+            self._counts.subtract(refs)
+        self._unknown.discard(key)
+
+    def _set(self, key, meta):
+        self._drop(key)
+        refs = value_refs(meta)
+        if refs is None:
+            self._unknown.add(key)
+        else:
+            self._refs[key] = refs
+            self._counts.update(refs)
+
+    def update(self, key, meta):
+        """
+        Account the meta just written under `key`
+        """
+        with self._lock:
+            if self._loaded_at is not None:
+                self._set(key, meta)
+
+    def remove(self, key):
+        """
+        Account the meta just deleted from under `key`
+        """
+        with self._lock:
+            if self._loaded_at is not None:
+                self._drop(key)
+
+    def delete_unreferenced(self, store, keys):
+        """
+        Delete the values of `keys` that no meta of `store` refers to,
+        returning the keys deleted
+
+        Nothing is deleted while some meta's references are unknown.
+        """
+        if (self._loaded_at is None or
+                time.time() - self._loaded_at > self.refresh):
+            self.load(store.read_all_meta())
+        with self._lock:
+            if self._unknown:
+                return set()
+            keys = {key for key in keys if self._counts[key] <= 0}
+        for key in keys:
+            store.delete(key)
+        return keys
+
+
+class ApiQuota:
+    """
+    Limits of the entries of API `api_name`
+
+    Its entries are read from the store on first use, and again every
+    `refresh` seconds to pick up those written by other processes. The
+    values of evicted entries are deleted once unreferenced in `refs`.
+    """
+
+    # at most this many of the oldest entries are weighed when evicting
+    candidates = 16
+
+    def __init__(self, api_name, max_bytes=None, max_entries=None, ttl=None,
+                 refresh=300, refs=None):
+        self.api_name = api_name
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh = refresh
+        self.refs = ValueRefs(refresh) if refs is None else refs
+
+        self.evicted = 0
+
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        # key -> (hash, size, time, cost), oldest first
+        self._entries = collections.OrderedDict()
+        self.nbytes = 0
+
+    def expired(self, meta):
+        if self.ttl is None:
+            return False
+        return time.time() - meta.get('time', 0) > self.ttl
+
+    def _load(self, store):
+        all_metas = store.read_all_meta()
+        self.refs.load(all_metas)
+        metas = [m for m in all_metas.values()
+                 if isinstance(m, dict) and m.get('api') == self.api_name]
+        metas.sort(key=lambda m: m.get('time', 0))
+
+        self._entries.clear()
+        self.nbytes = 0
+        for meta in metas:
+            self._add(meta['key'], meta)
+        self._loaded_at = time.time()
+        LOG.debug('%s: %d entries (%d bytes) accounted', self.api_name,
+                  len(self._entries), self.nbytes)
+
+    def _add(self, key, meta):
+        self._remove(key)
+        entry = (meta.get('hash') or '', meta.get('size', 0),
+                 meta.get('time', 0), meta.get('cost'))
+        self._entries[key] = entry
+        self.nbytes += entry[1]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+        return entry
+
+    def _over(self):
+        return (self.max_bytes is not None and self.nbytes > self.max_bytes
+                ) or (self.max_entries is not None and
+                      len(self._entries) > self.max_entries)
+
+    def add(self, store, key, meta):
+        """
+        Account the entry just written under `key`, and evict what no
+        longer fits
+        """
+        with self._lock:
+            if (self._loaded_at is None or
+                    time.time() - self._loaded_at > self.refresh):
+                self._load(store)
+            else:
+                self._add(key, meta)
+            self._enforce(store)
+
+    def enforce(self, store):
+        with self._lock:
+            if self._loaded_at is None:
+                self._load(store)
+            self._enforce(store)
+
+    def _enforce(self, store):
+        values = set()
+        if self.ttl is not None:
+            expiry = time.time() - self.ttl
+            expired = [k for k, entry in self._entries.items()
+                       if entry[2] < expiry]
+            for key in expired:
+                values |= self._evict(store, key)
+        while self._over():
+            values |= self._evict(store, self._victim())
+        if values:
+            self.refs.delete_unreferenced(store, values)
+
+    @staticmethod
+    def _benefit(entry):
+        _, size, _, cost = entry
+        if cost is None:  # unknown, as good as any
+            return float('inf')
+        return cost / max(size, 1)
+
+    def _victim(self):
+        # among the oldest quarter, so recent entries are kept regardless
+        n = max(1, min(self.candidates, len(self._entries) // 4))
+        oldest = itertools.islice(self._entries.items(), n)
+        return min(oldest, key=lambda item: self._benefit(item[1]))[0]
+
+    def _evict(self, store, key):
+        # the meta only, returning the values it refers to
+        value_hash, size, _, _ = self._remove(key)
+        meta = store.read_meta(key)
+        store.delete_meta(key)
+        self.refs.remove(key)
+        self.evicted += 1
+        LOG.debug('%s: evicted %s (%d bytes)', self.api_name, key, size)
+        refs = value_refs(meta) if isinstance(meta, dict) else None
+        return refs or ({value_hash} if value_hash else set())
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.nbytes,
+                'evicted': self.evicted}
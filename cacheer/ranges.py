@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+Range segments of time-series results
+
+A function cached in range mode returns a DataFrame/Series over a range
+dimension (its index, an index level or a column) bounded by its `start`
+and `end` arguments, both ends included. Results are stored as segments
+`(start, end, hash)` that never overlap, so any requested range is served
+by stitching segments and calling the function only over the gaps.
+
+Gaps are queried with the bounds of their neighbouring segments, since
+"the day after" a bound is unknown in general; rows at a bound that is
+already covered are dropped from what the function returns.
+"""
+
+import numbers
+
+
+def coerce_bound(value):
+    """
+    Comparable form of a range bound: numbers as they are, anything else
+    (dates, datetimes, '20240630', '2024-06-30') as a pandas Timestamp
+    """
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return value
+    import pandas as pd
+    return pd.Timestamp(value)
+
+
+def _range_values(obj, index=None):
+    import pandas as pd
+
+    if index is None:
+        values = obj.index.get_level_values(0)
+    elif index in obj.index.names:
+        values = obj.index.get_level_values(index)
+    elif isinstance(obj, pd.DataFrame) and index in obj.columns:
+        values = pd.Index(obj[index])
+    else:
+        raise KeyError('range dimension `{}` not found'.format(index))
+
+    if values.dtype.kind not in 'iufM':
+        values = pd.to_datetime(values)
+    return values
+
+
+def select_range(obj, start, end, index=None,
+                 include_start=True, include_end=True):
+    """
+    Rows of `obj` whose range coordinate lies between `start` and `end`
+    """
+    values = _range_values(obj, index)
+    start, end = coerce_bound(start), coerce_bound(end)
+    mask = (values >= start) if include_start else (values > start)
+    mask &= (values <= end) if include_end else (values < end)
+    if mask.all():
+        return obj
+    return obj[mask]
+
+
+def missing_ranges(segments, start, end):
+    """
+    Sub-ranges of [start, end] not covered by `segments`, as
+    `(start, end, include_start, include_end)`, ends excluded where they
+    touch a segment
+
+    Parameters
+    ----------
+    segments: `list`
+        (start, end, hash) sorted by start, not overlapping
+    """
+    lo, hi = coerce_bound(start), coerce_bound(end)
+    gaps = []
+    cursor, cursor_raw, covered = lo, start, False
+
+    for seg_start, seg_end, _ in segments:
+        s, e = coerce_bound(seg_start), coerce_bound(seg_end)
+        if e < cursor:
+            continue
+        if s > hi:
+            break
+        if s > cursor:
+            gaps.append((cursor_raw, seg_start, not covered, False))
+        cursor, cursor_raw, covered = e, seg_end, True
+        if cursor >= hi:
+            return gaps
+
+    gaps.append((cursor_raw, end, not covered, True))
+    return gaps
+
+
+def overlapping(segments, start, end):
+    """
+    Segments overlapping or touching [start, end]
+    """
+    lo, hi = coerce_bound(start), coerce_bound(end)
+    return [seg for seg in segments
+            if coerce_bound(seg[0]) <= hi and coerce_bound(seg[1]) >= lo]
+
+
+def merge_segments(segments, new):
+    """
+    Replace segments overlapping or touching `new` by `new`
+    """
+    lo, hi = coerce_bound(new[0]), coerce_bound(new[1])
+    kept = [seg for seg in segments
+            if coerce_bound(seg[1]) < lo or coerce_bound(seg[0]) > hi]
+    kept.append(tuple(new))
+    return sorted(kept, key=lambda seg: coerce_bound(seg[0]))
+
+
+def stitch(parts, index=None):
+    """
+    Concatenate non-overlapping parts in range order
+    """
+    import pandas as pd
+
+    parts = [p for p in parts if p is not None]
+    non_empty = [p for p in parts if len(p)]
+    if not non_empty:
+        return parts[0] if parts else None
+    if len(non_empty) == 1:
+        return non_empty[0]
+
+    non_empty.sort(key=lambda p: _range_values(p, index).min())
+    return pd.concat(non_empty)
@@ -1,9 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os
-import logging.config
-
-import yaml
+import sys
 
 import time
 import functools
@@ -12,13 +10,16 @@ import hashlib
 import __main__
 
 import pickle
-import pyarrow as pa
-import pandas as pd
-import numpy as np
+import struct
+import operator
+import itertools
 
 from cacheer import settings
 from cacheer.utils import timeit
 
+# pandas/pyarrow are imported only once a DataFrame path is taken; a value
+# can't be a DataFrame unless pandas has already been imported by the caller
+
 
 class Serializer:
 
@@ -38,7 +39,16 @@ class Serializer:
 
 
 def _count_elements(df):
-    return np.product(df.shape)
+    return df.shape[0] * df.shape[1]
+
+
+def _is_dataframe(obj):
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(obj, pd.DataFrame)
+
+
+def _is_large_dataframe(obj):
+    return _is_dataframe(obj) and _count_elements(obj) > 30000
 
 
 class Picklizer(Serializer):
@@ -64,7 +74,8 @@ class Picklizer1(Serializer):
     def serialize(obj):
         if isinstance(obj, bytes):
             return obj
-        if isinstance(obj, pd.DataFrame) and np.product(obj.shape) > 30000:
+        if _is_large_dataframe(obj):
+            import pyarrow as pa
             pa_buffer = pa.serialize_pandas(obj)
             return pa_buffer.to_pybytes()
         return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
@@ -74,6 +85,7 @@ class Picklizer1(Serializer):
         try:
             obj = pickle.loads(b)
         except pickle.UnpicklingError:
+            import pyarrow as pa
             obj = pa.deserialize_pandas(b)
         return obj
 
@@ -86,6 +98,7 @@ class Picklizer2(Serializer):
 
     @staticmethod
     def to_table(df):
+        import pyarrow as pa
         return pa.Table.from_pandas(df)
 
     @staticmethod
@@ -96,14 +109,15 @@ class Picklizer2(Serializer):
     def serialize(cls, obj):
         if isinstance(obj, bytes):
             return obj
-        if isinstance(obj, pd.DataFrame) and np.product(obj.shape) > 30000:
+        if _is_large_dataframe(obj):
             obj = cls.to_table(obj)
         return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
 
     @classmethod
     def deserialize(cls, b):
         obj = pickle.loads(b)
-        if isinstance(obj, pa.Table):
+        pa = sys.modules.get('pyarrow')
+        if pa is not None and isinstance(obj, pa.Table):
             obj = cls.to_dataframe(obj)
         return obj
 
@@ -153,7 +167,7 @@ class Picklizer3(Serializer):
         if isinstance(obj, bytes):
             return obj
         try:
-            if isinstance(obj, pd.DataFrame) and np.product(obj.shape) > 30000:
+            if _is_large_dataframe(obj):
                 obj = cls.categorize(obj, copy=True)
         except TypeError:
             pass
@@ -162,24 +176,798 @@ class Picklizer3(Serializer):
     @classmethod
     def deserialize(cls, b):
         obj = pickle.loads(b)
-        if isinstance(obj, pd.DataFrame):
+        if _is_dataframe(obj):
             obj = cls.decategorize(obj)
         return obj
 
 
-serializer_type = settings.conf.get('serializer-type', 3)
-serializer = {
+class LegacyPicklizer(Serializer):
+    """
+    Reads back what any of Picklizer/Picklizer1/Picklizer2/Picklizer3
+    wrote
+
+    Pickled DataFrames have their `category` columns turned back to
+    `object` as Picklizer3, the former default, did.
+    """
+
+    @staticmethod
+    def serialize(obj):
+        return Picklizer.serialize(obj)
+
+    @staticmethod
+    def deserialize(b):
+        try:
+            obj = pickle.loads(b)
+        except pickle.UnpicklingError:
+            import pyarrow as pa
+            return pa.deserialize_pandas(b)
+        if _is_dataframe(obj):
+            return Picklizer3.decategorize(obj)
+        pa = sys.modules.get('pyarrow')
+        if pa is not None and isinstance(obj, pa.Table):
+            obj = obj.to_pandas()
+        return obj
+
+
+# Tagged format: a fixed header naming the codec, followed by its payload
+#   magic (4s) | format version (B) | codec tag (11s)
+MAGIC = b'CCHR'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sB11s')
+
+# payload offsets of raw buffers are aligned to this, counted from the
+# start of the stored value
+ALIGNMENT = 64
+
+
+def is_tagged(b):
+    return b[:4] == MAGIC
+
+
+def _padding(offset):
+    return -(HEADER.size + offset) % ALIGNMENT
+
+
+class Codec:
+    """
+    Encodes values of the types it's registered for, `tag` identifies its
+    format in the stored header
+    """
+
+    tag = None
+
+    # whether decoded values may share memory with a read-only payload,
+    # assumed unless the codec knows its values own their memory
+    borrows = True
+
+    def encode(self, obj):
+        """
+        Returns a list of bytes-like parts, or None to decline the value,
+        which then falls back to pickle
+        """
+        raise NotImplementedError
+
+    def decode(self, buf):
+        """
+        `buf` is a memoryview of the payload following the header
+        """
+        raise NotImplementedError
+
+
+class PickleCodec(Codec):
+
+    tag = 'pickle'
+    borrows = False
+
+    def encode(self, obj):
+        return [pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)]
+
+    def decode(self, buf):
+        return pickle.loads(buf)
+
+
+class NdarrayCodec(Codec):
+    """
+    dtype + shape + raw bytes of an array, object arrays are declined
+    """
+
+    tag = 'ndarray'
+    borrows = False
+
+    def encode(self, arr):
+        import numpy as np
+
+        if arr.dtype.hasobject:
+            return None
+
+        fortran = arr.flags.f_contiguous and not arr.flags.c_contiguous
+        if not (arr.flags.c_contiguous or fortran):
+            arr = np.ascontiguousarray(arr)
+
+        meta = pickle.dumps(
+            (np.lib.format.dtype_to_descr(arr.dtype), arr.shape, fortran),
+            pickle.HIGHEST_PROTOCOL)
+        prefix = struct.pack('<I', len(meta)) + meta
+        prefix += b'\0' * _padding(len(prefix))
+        return [prefix, arr.reshape(-1, order='A').view('u1').data]
+
+    def decode(self, buf):
+        import numpy as np
+
+        meta_len, = struct.unpack_from('<I', buf)
+        descr, shape, fortran = pickle.loads(buf[4:4 + meta_len])
+        offset = 4 + meta_len
+        offset += _padding(offset)
+
+        dtype = np.lib.format.descr_to_dtype(descr)
+        count = 1
+        for n in shape:
+            count *= n
+        arr = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+        arr = arr.reshape(shape, order='F' if fortran else 'C')
+        if not arr.flags.writeable:
+            arr = arr.copy(order='K')
+        return arr
+
+
+def _write_arrow_file(table):
+    import pyarrow as pa
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _read_arrow_file(buf):
+    import pyarrow as pa
+    return pa.ipc.open_file(pa.py_buffer(buf)).read_all()
+
+
+class ArrowTableCodec(Codec):
+    """
+    Arrow IPC file format, read back without copying
+    """
+
+    tag = 'arrow'
+    borrows = True
+
+    def encode(self, table):
+        return [_write_arrow_file(table)]
+
+    def decode(self, buf):
+        return _read_arrow_file(buf)
+
+
+class PandasCodec(Codec):
+    """
+    DataFrame/Series through an Arrow IPC file
+
+    Values smaller than `min_elements`, or that Arrow can't convert back
+    as they were, are declined: object columns or index levels holding
+    anything but `str`, columns not labeled by a plain index of `str`.
+    """
+
+    tag = 'pandas'
+    # Arrow backed columns, e.g. strings, keep pointing into the payload
+    borrows = True
+
+    # column name standing in for an unnamed Series
+    _unnamed = '__series__'
+
+    def __init__(self, min_elements=30000):
+        self.min_elements = min_elements
+
+    def encode(self, obj):
+        import pyarrow as pa
+
+        is_series = obj.ndim == 1
+        if obj.size < self.min_elements:
+            return None
+        if is_series:
+            if obj.name == self._unnamed:
+                return None
+            name = self._unnamed if obj.name is None else obj.name
+            obj = obj.to_frame(name=name)
+        if not self._round_trips(obj):
+            return None
+
+        try:
+            table = pa.Table.from_pandas(obj)
+        except (pa.ArrowException, TypeError, ValueError):
+            return None
+        return [b'S' if is_series else b'F', _write_arrow_file(table)]
+
+    @staticmethod
+    def _all_str(values):
+        # object values only come back as they were if all `str`, and
+        # while pandas doesn't read strings back as its `str` dtype
+        import pandas as pd
+
+        dtype = values.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            values = dtype.categories
+            dtype = values.dtype
+        if dtype != object:
+            return True
+        try:
+            if pd.get_option('future.infer_string'):
+                return False
+        except KeyError:  # pandas < 2.1
+            pass
+        return pd.api.types.infer_dtype(values, skipna=False) == 'string'
+
+    def _round_trips(self, df):
+        import pandas as pd
+
+        columns = df.columns
+        if type(columns) is not pd.Index or not self._all_str(columns) or \
+                pd.api.types.infer_dtype(columns, skipna=False) != 'string':
+            return False
+        index = df.index
+        levels = index.levels if isinstance(index, pd.MultiIndex) else [index]
+        if not all(self._all_str(level) for level in levels):
+            return False
+        return all(self._all_str(values) for _, values in df.items())
+
+    def decode(self, buf):
+        obj = _read_arrow_file(buf[1:]).to_pandas()
+        if buf[:1] == b'S':
+            obj = obj.iloc[:, 0]
+            if obj.name == self._unnamed:
+                obj.name = None
+        return obj
+
+
+class OutOfBandPickleCodec(Codec):
+    """
+    Pickle protocol 5, with buffers of at least `min_size` bytes (numpy
+    arrays, pandas blocks...) kept out of the pickle stream as aligned
+    chunks, and handed back to pickle as views of the stored value
+
+    Arrays restored this way share memory with the stored value, and are
+    read-only if it is.
+    """
+
+    tag = 'pickle5'
+    borrows = True
+
+    # count (Q) | pickle length (Q) | (offset, length) (QQ) per buffer
+    _table = struct.Struct('<QQ')
+
+    def __init__(self, min_size=64 * 1024):
+        self.min_size = min_size
+
+    def encode(self, obj):
+        buffers = []
+
+        def _callback(pickle_buffer):
+            try:
+                raw = pickle_buffer.raw()
+            except BufferError:  # non-contiguous, keep in-band
+                return True
+            if raw.nbytes < self.min_size:
+                return True
+            buffers.append(raw)
+            return False
+
+        data = pickle.dumps(obj, protocol=5, buffer_callback=_callback)
+
+        offset = self._table.size * (1 + len(buffers)) + len(data)
+        entries, parts = [], []
+        for raw in buffers:
+            pad = _padding(offset)
+            offset += pad
+            entries.append((offset, raw.nbytes))
+            parts.extend([b'\0' * pad, raw])
+            offset += raw.nbytes
+
+        table = struct.pack(f'<QQ{2 * len(buffers)}Q', len(buffers),
+                            len(data), *itertools.chain(*entries))
+        return [table, data] + parts
+
+    def decode(self, buf):
+        count, data_len = self._table.unpack_from(buf)
+        entries = struct.unpack_from(f'<{2 * count}Q', buf, self._table.size)
+        start = self._table.size * (1 + count)
+        buffers = [buf[offset:offset + length] for offset, length
+                   in zip(entries[::2], entries[1::2])]
+        return pickle.loads(buf[start:start + data_len], buffers=buffers)
+
+
+class Chunks(list):
+    """
+    A serialized value kept as the list of bytes-like parts it was encoded
+    to, so that it can be hashed and written out without joining them
+    """
+
+    @property
+    def nbytes(self):
+        return sum(memoryview(p).nbytes for p in self)
+
+    def tobytes(self):
+        return b''.join(self)
+
+
+class SerializerRegistry:
+    """
+    Maps value types to codecs
+
+    Types are matched exactly, and may be given by a dotted name (e.g.
+    'pandas.DataFrame'), resolved once its module has been imported by
+    someone else, so that registering doesn't import the library. Values of
+    unregistered types are pickled.
+    """
+
+    def __init__(self, default=None):
+        self.default = default or PickleCodec()
+        self._by_type = {}
+        self._by_name = {}
+        self._by_tag = {self.default.tag: self.default}
+        self._dispatch = {}
+
+    def register(self, types, codec):
+        if not isinstance(types, (list, tuple)):
+            types = [types]
+        if len(codec.tag.encode()) > 11:
+            raise ValueError(f'Codec tag too long: {codec.tag}')
+        registered = self._by_tag.setdefault(codec.tag, codec)
+        if registered is not codec:
+            raise ValueError(f'Codec tag already registered: {codec.tag}')
+        for t in types:
+            if isinstance(t, str):
+                self._by_name[t] = codec
+            else:
+                self._by_type[t] = codec
+        self._dispatch.clear()
+
+    def has_codec(self, codec):
+        return self._by_tag.get(codec.tag) is codec
+
+    def add_codec(self, codec):
+        """
+        Make values tagged by `codec` readable, without dispatching to it
+        """
+        self.register([], codec)
+
+    def _resolve_names(self):
+        for name, codec in list(self._by_name.items()):
+            module, attr = name.rsplit('.', 1)
+            if module in sys.modules:
+                t = getattr(sys.modules[module], attr, None)
+                if isinstance(t, type):
+                    self._by_type.setdefault(t, codec)
+                self._by_name.pop(name, None)
+
+    def codec_for(self, obj):
+        cls = type(obj)
+        try:
+            return self._dispatch[cls]
+        except KeyError:
+            pass
+        if self._by_name:
+            self._resolve_names()
+        codec = self._by_type.get(cls, self.default)
+        self._dispatch[cls] = codec
+        return codec
+
+    def encode_chunks(self, obj):
+        codec = self.codec_for(obj)
+        parts = codec.encode(obj)
+        if parts is None:
+            codec = self.default
+            parts = codec.encode(obj)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, codec.tag.encode())
+        return Chunks([header] + parts)
+
+    def encode(self, obj):
+        return self.encode_chunks(obj).tobytes()
+
+    def decode(self, b):
+        magic, version, tag = HEADER.unpack_from(b)
+        tag = tag.rstrip(b'\0').decode()
+        try:
+            codec = self._by_tag[tag]
+        except KeyError:
+            raise ValueError(f'No codec registered for `{tag}`')
+        return codec.decode(memoryview(b)[HEADER.size:])
+
+    def borrows(self, b):
+        tag = HEADER.unpack_from(b)[2].rstrip(b'\0').decode()
+        codec = self._by_tag.get(tag)
+        return codec is None or codec.borrows
+
+
+_ndarray_codec = NdarrayCodec()
+_arrow_codec = ArrowTableCodec()
+_pandas_codec = PandasCodec()
+_oob_codec = OutOfBandPickleCodec()
+
+registry = SerializerRegistry()
+registry.register('numpy.ndarray', _ndarray_codec)
+registry.register('pyarrow.Table', _arrow_codec)
+registry.register(['pandas.DataFrame', 'pandas.Series'], _pandas_codec)
+registry.add_codec(_oob_codec)
+
+# pandas objects and anything unregistered go through out-of-band pickle
+oob_registry = SerializerRegistry(default=_oob_codec)
+oob_registry.register('numpy.ndarray', _ndarray_codec)
+oob_registry.register('pyarrow.Table', _arrow_codec)
+oob_registry.add_codec(_pandas_codec)
+oob_registry.add_codec(registry.default)
+
+
+def register(types, codec):
+    """
+    Serialize values of `types` with `codec`
+
+    Parameters
+    ----------
+    types: `type`, `str` or a list of them
+        exact types, or their dotted names such as 'pandas.DataFrame'
+    codec: `Codec`
+        with a tag unique across codecs, at most 11 bytes long
+    """
+    registry.register(types, codec)
+    oob_registry.register(types, codec)
+
+
+# Partial loads: `columns` keeps a subset of columns, `filter` keeps rows,
+# either given as a list of (column, op, value) conditions that are ANDed,
+# with op one of ==, !=, <, <=, >, >=, in, not in, or as a callable taking
+# the frame and returning a boolean mask. Index levels can be referred to by
+# name in conditions.
+
+_FILTER_OPS = {
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+
+def _filter_columns(filter):
+    if filter is None or callable(filter):
+        return []
+    return [col for col, op, value in filter]
+
+
+def project(obj, columns=None, filter=None):
+    """
+    Apply `columns`/`filter` to an already loaded DataFrame or Arrow table
+    """
+    if columns is None and filter is None:
+        return obj
+
+    pa = sys.modules.get('pyarrow')
+    if pa is not None and isinstance(obj, pa.Table):
+        if callable(filter):
+            obj = obj.filter(filter(obj))
+        elif filter is not None:
+            obj = obj.filter(_arrow_mask(obj, filter))
+        return obj if columns is None else obj.select(columns)
+
+    pd = sys.modules.get('pandas')
+    is_series = pd is not None and isinstance(obj, pd.Series)
+    if not (is_series or _is_dataframe(obj)):
+        raise TypeError(f'Cannot project a `{type(obj).__name__}`')
+
+    if callable(filter):
+        obj = obj[filter(obj)]
+    elif filter is not None:
+        mask = None
+        for col, op, value in filter:
+            if is_series and col == obj.name:
+                values = obj
+            elif not is_series and col in obj.columns:
+                values = obj[col]
+            else:
+                values = obj.index.get_level_values(col)
+            if op == 'in':
+                cond = values.isin(value)
+            elif op == 'not in':
+                cond = ~values.isin(value)
+            else:
+                cond = _FILTER_OPS[op](values, value)
+            cond = getattr(cond, 'values', cond)
+            mask = cond if mask is None else mask & cond
+        obj = obj[mask]
+    if columns is None or is_series:  # columns don't apply to a Series
+        return obj
+    return obj[list(columns)]
+
+
+def _arrow_scalar(value, type_):
+    import pyarrow as pa
+    try:
+        return pa.scalar(value, type=type_)
+    except (pa.ArrowException, TypeError, ValueError):
+        if pa.types.is_timestamp(type_) or pa.types.is_date(type_):
+            import pandas as pd
+            return pa.scalar(pd.Timestamp(value), type=type_)
+        raise
+
+
+def _arrow_mask(table, filter):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    names = {'==': 'equal', '=': 'equal', '!=': 'not_equal',
+             '<': 'less', '<=': 'less_equal',
+             '>': 'greater', '>=': 'greater_equal'}
+    mask = None
+    for col, op, value in filter:
+        values = table[col]
+        if op in ('in', 'not in'):
+            value_set = pa.array(
+                [_arrow_scalar(v, values.type).as_py() for v in value],
+                type=values.type)
+            cond = pc.is_in(values, value_set=value_set)
+            if op == 'not in':
+                cond = pc.invert(cond)
+        else:
+            cond = getattr(pc, names[op])(
+                values, _arrow_scalar(value, values.type))
+        mask = cond if mask is None else pc.and_(mask, cond)
+    return pc.fill_null(mask, False)
+
+
+class _SubFile:
+    """
+    Read-only view of a seekable file from `offset` on, as pyarrow wants it
+    """
+
+    def __init__(self, f, offset):
+        self._f = f
+        self._offset = offset
+        self._size = None
+        self.closed = False
+
+    def size(self):
+        if self._size is None:
+            pos = self._f.tell()
+            self._f.seek(0, os.SEEK_END)
+            self._size = self._f.tell() - self._offset
+            self._f.seek(pos)
+        return self._size
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos += self._offset
+        elif whence == os.SEEK_END:
+            pos += self._offset + self.size()
+            whence = os.SEEK_SET
+        self._f.seek(pos, whence)
+        return self.tell()
+
+    def tell(self):
+        return self._f.tell() - self._offset
+
+    def read(self, n=-1):
+        return self._f.read(n)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def close(self):
+        self.closed = True
+
+
+def _read_arrow_partial(source, columns=None, filter=None, pandas=True):
+    """
+    Read only the columns needed for `columns`/`filter` from an Arrow IPC
+    file, `source` being a buffer or a seekable file
+    """
+    import pyarrow as pa
+
+    if isinstance(source, _SubFile):
+        source = pa.PythonFile(source, mode='r')
+    else:
+        source = pa.py_buffer(source)
+    schema = pa.ipc.open_file(source).schema
+
+    index_meta = []
+    if pandas and schema.pandas_metadata:
+        index_meta = schema.pandas_metadata['index_columns']
+    index_columns = [i for i in index_meta if isinstance(i, str)]
+
+    if columns is None:
+        fields = None
+    else:
+        wanted = set(columns) | set(_filter_columns(filter))
+        wanted |= set(index_columns)
+        fields = [i for i, name in enumerate(schema.names) if name in wanted]
+
+    options = pa.ipc.IpcReadOptions(included_fields=fields)
+    table = pa.ipc.open_file(source, options=options).read_all()
+
+    mask = None
+    if filter is not None and not callable(filter):
+        mask = _arrow_mask(table, filter)
+        table = table.filter(mask)
+
+    if not pandas:
+        return project(table, columns, filter if callable(filter) else None)
+
+    df = table.to_pandas()
+    range_index = [i for i in index_meta if isinstance(i, dict)]
+    if mask is not None and range_index and range_index[0]['kind'] == 'range':
+        # keep the original labels of a RangeIndex over the kept rows
+        import pyarrow.compute as pc
+        start, step = range_index[0]['start'], range_index[0]['step']
+        kept = pc.indices_nonzero(mask).to_numpy().astype('int64')
+        df.index = start + step * kept
+        df.index.name = range_index[0]['name']
+
+    if callable(filter):
+        df = df[filter(df)]
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+class TypedSerializer(Serializer):
+    """
+    Picks a codec per value type from a registry and tags the stored value
+    with it, so reading back doesn't depend on config
+
+    Untagged values are read with `legacy`; if `legacy_writes` is set,
+    values are also written untagged with it.
+
+    `gen_md5(..., value=True)` returns values of at least `min_chunks_size`
+    bytes as `Chunks`, which stores write out part by part.
+    """
+
+    def __init__(self, registry, legacy=LegacyPicklizer, legacy_writes=False,
+                 min_chunks_size=1024 * 1024):
+        self.registry = registry
+        self.legacy = legacy
+        self.legacy_writes = legacy_writes
+        self.min_chunks_size = min_chunks_size
+
+    def serialize(self, obj):
+        if isinstance(obj, (bytes, Chunks)):
+            return obj
+        if self.legacy_writes:
+            return self.legacy.serialize(obj)
+        return self.registry.encode(obj)
+
+    def serialize_chunks(self, obj):
+        if isinstance(obj, (bytes, Chunks)) or self.legacy_writes:
+            return self.serialize(obj)
+        chunks = self.registry.encode_chunks(obj)
+        if chunks.nbytes < self.min_chunks_size:
+            return chunks.tobytes()
+        return chunks
+
+    def deserialize(self, b):
+        if is_tagged(b):
+            return self.registry.decode(b)
+        return self.legacy.deserialize(b)
+
+    def borrows(self, b):
+        """
+        Whether values read from the buffer `b` may keep referring to it,
+        so that `b` must outlive them
+        """
+        if is_tagged(b):
+            return self.registry.borrows(b)
+        return True  # legacy arrow formats
+
+    def deserialize_partial(self, source, columns=None, filter=None):
+        """
+        Load `columns`/rows matching `filter` of a stored DataFrame or Arrow
+        table
+
+        `source` is the stored value, or a seekable file over it. Values
+        stored by the Arrow based codecs only have the needed columns read,
+        others are loaded in full and projected.
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            header = bytes(source[:HEADER.size])
+        else:
+            header = source.read(HEADER.size)
+            source.seek(0)
+
+        tag = None
+        if is_tagged(header):
+            tag = HEADER.unpack(header)[2].rstrip(b'\0').decode()
+        if tag == _pandas_codec.tag and self.registry.has_codec(_pandas_codec):
+            kind_offset = HEADER.size
+        elif tag == _arrow_codec.tag and self.registry.has_codec(_arrow_codec):
+            kind_offset = None
+        else:
+            if not isinstance(source, (bytes, bytearray, memoryview)):
+                source = source.read()
+            return project(self.deserialize(source), columns, filter)
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            buf = memoryview(source)
+            kind = buf[kind_offset:kind_offset + 1] if kind_offset else None
+            offset = HEADER.size + (1 if kind_offset else 0)
+            arrow_source = buf[offset:]
+        else:
+            source.seek(kind_offset or 0)
+            kind = source.read(1) if kind_offset else None
+            offset = HEADER.size + (1 if kind_offset else 0)
+            arrow_source = _SubFile(source, offset)
+
+        if kind is None:
+            return _read_arrow_partial(arrow_source, columns, filter,
+                                       pandas=False)
+        if kind == b'S':  # columns don't apply to a Series
+            columns = None
+        obj = _read_arrow_partial(arrow_source, columns, filter)
+        if kind == b'S':
+            obj = obj.iloc[:, 0]
+            if obj.name == PandasCodec._unnamed:
+                obj.name = None
+        return obj
+
+    def gen_md5(self, b, value=False):
+        bytes_ = self.serialize_chunks(b)
+        if isinstance(bytes_, Chunks):
+            md5 = hashlib.md5()
+            for part in bytes_:
+                md5.update(part)
+            md5 = md5.hexdigest()
+        else:
+            md5 = hashlib.md5(bytes_).hexdigest()
+        if value:
+            return md5, bytes_
+        return md5
+
+
+SERIALIZERS = {
     0: Picklizer,
     1: Picklizer1,
     2: Picklizer2,
     3: Picklizer3
-}[serializer_type]
+}
+
+
+class LazySerializer:
+    """
+    Resolves the configured serializer on first use, so that importing
+    this module doesn't read config
+    """
+
+    def __init__(self):
+        self._serializer = None
+
+    def _resolve(self):
+        if self._serializer is None:
+            serializer_type = settings.conf.get('serializer-type', 'typed')
+            if serializer_type == 'typed':
+                self._serializer = TypedSerializer(registry)
+            elif serializer_type == 'oob':
+                _oob_codec.min_size = settings.conf.get(
+                    'serializer-oob-min-size', _oob_codec.min_size)
+                self._serializer = TypedSerializer(oob_registry)
+            else:
+                # legacy formats are still written, tagged ones still read
+                self._serializer = TypedSerializer(
+                    registry, legacy=SERIALIZERS[serializer_type],
+                    legacy_writes=True)
+        return self._serializer
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+serializer = LazySerializer()
 
 
 def benchmark_object(obj, number=5):
     import timeit
+    import pandas as pd
 
-    ps = Picklizer(), Picklizer1(), Picklizer2(), Picklizer3()
+    ps = (Picklizer(), Picklizer1(), Picklizer2(), Picklizer3(),
+          TypedSerializer(registry))
 
     ser_res, deser_res = [], []
     for p in ps:
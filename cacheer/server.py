@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+Node-local cache server
+
+    python -m cacheer serve --socket /tmp/cacheer.sock --memory 4GB
+
+owns the on-disk store of a node and keeps serialized values in memory, as
+a hot tier shared by all processes of the node. Writes are applied to disk
+in batches, as by `WriterDaemon`, and are readable from memory at once.
+
+With `server-socket` set in config, processes use `SocketCacheStore` as a
+thin client, and their local store only while the server is unavailable.
+"""
+
+import pickle
+import logging
+import threading
+
+from cacheer import ipc
+from cacheer.serializer import serializer, Chunks
+from cacheer.store import MemoryCacheStore
+from cacheer.writer import (WriterDaemon, WriterClientStore, OPS,
+                            WRITE, WRITE_META, DELETE, DELETE_META)
+
+LOG = logging.getLogger('cacheer.manager')
+
+# requests answered by the server, after the write ops
+GET, HAS, READ_META, READ_ALL_META, KEYS = range(len(OPS), len(OPS) + 5)
+
+# reply status
+FOUND, MISSING, ERROR = range(3)
+
+
+class CacheServer(WriterDaemon):
+    """
+    `WriterDaemon` also answering reads, from memory first
+    """
+
+    def __init__(self, path, store, memory_bytes=1024 ** 3, **kw):
+        super().__init__(path, store, **kw)
+        self.memory = MemoryCacheStore(memory_bytes)
+        self.memory_hits = 0
+        self.store_reads = 0
+        # deletes received but not applied yet, by (op, key)
+        self._deleting = {}
+        self._deleting_lock = threading.Lock()
+
+    def serve_forever(self):
+        try:
+            super().serve_forever()
+        finally:
+            LOG.info('Cache server answered %d reads from memory, %d from '
+                     'store', self.memory_hits, self.store_reads)
+
+    def _receive(self, conn):
+        try:
+            while True:
+                op, key, payload = ipc.recv_frame(conn)
+                if op < GET:
+                    self._update_memory(op, key, payload)
+                    self._enqueue(op, key, payload, conn)
+                    continue
+                try:
+                    status, reply = self._answer(op, key)
+                except Exception:
+                    LOG.error('Cache server failed to answer %s', key,
+                              exc_info=True)
+                    status, reply = ERROR, b''
+                ipc.send_frame(conn, status, '', reply)
+        except ipc.ConnectionClosed:
+            pass
+        except OSError:
+            LOG.warning('Cache server connection lost', exc_info=True)
+
+    def _update_memory(self, op, key, payload):
+        if op == WRITE:
+            self.memory.write(key, Chunks([payload]))
+        elif op == WRITE_META:
+            self.memory.write_meta(key, bytes(payload))
+        elif op in (DELETE, DELETE_META):
+            if op == DELETE:
+                self.memory.delete(key)
+            else:
+                self.memory.delete_meta(key)
+            with self._deleting_lock:
+                self._deleting[op, key] = self._deleting.get((op, key), 0) + 1
+
+    def _apply(self, batch):
+        super()._apply(batch)
+        with self._deleting_lock:
+            for op, key, _, _ in batch:
+                if op in (DELETE, DELETE_META):
+                    count = self._deleting.pop((op, key), 1) - 1
+                    if count:
+                        self._deleting[op, key] = count
+
+    def _answer(self, op, key):
+        if op == GET:
+            b_value = self.memory.read_raw(key)
+            if b_value is not None:
+                self.memory_hits += 1
+            elif (DELETE, key) not in self._deleting:
+                self.store_reads += 1
+                b_value = self.store.read_raw(key)
+                if b_value is not None:
+                    self.memory.write(key, Chunks([b_value]))
+            if b_value is None:
+                return MISSING, b''
+            return FOUND, b_value
+
+        if op == HAS:
+            found = self.memory.has_key(key) or (
+                (DELETE, key) not in self._deleting and
+                self.store.has_key(key))
+            return (FOUND if found else MISSING), b''
+
+        if op == READ_META:
+            meta = self.memory.read_meta(key)
+            if meta is None and (DELETE_META, key) not in self._deleting:
+                meta = self.store.read_meta(key)
+                if meta is not None:
+                    self.memory.write_meta(key, meta)
+            if meta is None:
+                return MISSING, b''
+            return FOUND, serializer.serialize(meta)
+
+        if op == READ_ALL_META:
+            meta = self.store.read_all_meta()
+            meta.update(self.memory.read_all_meta())
+            prefix = self.memory._cache_meta_prefix
+            with self._deleting_lock:
+                deleting = list(self._deleting)
+            for op_, key_ in deleting:
+                if op_ == DELETE_META:
+                    meta.pop(prefix + key_, None)
+            return FOUND, pickle.dumps(meta, pickle.HIGHEST_PROTOCOL)
+
+        if op == KEYS:
+            keys = set(self.store.keys()) | set(self.memory.keys())
+            return FOUND, pickle.dumps(sorted(keys), pickle.HIGHEST_PROTOCOL)
+
+        raise ValueError('unknown op {}'.format(op))
+
+
+class SocketCacheStore(WriterClientStore):
+    """
+    Cache store served by a `CacheServer` at `path`, `store` being used
+    while the server can't be reached
+    """
+
+    def _request(self, op, key=''):
+        # (status, payload), or None if the server is unavailable
+        try:
+            conn = self._conn()
+            with conn.lock:
+                ipc.send_frame(conn.sock, op, key, b'')
+                status, _, payload = ipc.recv_frame(conn.sock)
+        except OSError:
+            self._lost()
+            return None
+        self._daemon_lost = False
+        if status == ERROR:
+            return None
+        return status, payload
+
+    def read_raw(self, key):
+        res = self._request(GET, key)
+        if res is None:
+            return self.store.read_raw(key)
+        status, payload = res
+        return payload if status == FOUND else None
+
+    def read(self, key):
+        b_value = self.read_raw(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize(b_value)
+
+    def read_partial(self, key, columns=None, filter=None):
+        b_value = self.read_raw(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize_partial(
+            b_value, columns=columns, filter=filter)
+
+    def has_key(self, key):
+        res = self._request(HAS, key)
+        if res is None:
+            return self.store.has_key(key)
+        return res[0] == FOUND
+
+    def keys(self):
+        res = self._request(KEYS)
+        if res is None:
+            return self.store.keys()
+        return pickle.loads(res[1])
+
+    def read_meta(self, key):
+        res = self._request(READ_META, key)
+        if res is None:
+            return self.store.read_meta(key)
+        status, payload = res
+        return serializer.deserialize(payload) if status == FOUND else None
+
+    def read_all_meta(self):
+        res = self._request(READ_ALL_META)
+        if res is None:
+            return self.store.read_all_meta()
+        return pickle.loads(res[1])
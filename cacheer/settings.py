@@ -1,6 +1,6 @@
 import os
 import logging
-import yaml
+import collections.abc
 
 
 def load_config(path):
@@ -10,9 +10,44 @@ def load_config(path):
     if not os.path.exists(path):
         return {}
 
+    import yaml
     with open(path, 'r') as f:
-        conf = yaml.load(f)
+        conf = yaml.load(f, Loader=yaml.SafeLoader)
     return conf
 
 
-conf = load_config(path=os.getenv('CACHEER_CONFIG'))
+class LazyConfig(collections.abc.MutableMapping):
+    """
+    Config that is only read and parsed on first access
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._conf = None
+
+    @property
+    def _data(self):
+        if self._conf is None:
+            self._conf = self._loader() or {}
+        return self._conf
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return repr(self._data)
+
+
+conf = LazyConfig(lambda: load_config(path=os.getenv('CACHEER_CONFIG')))
@@ -1,26 +1,29 @@
 # -*- coding: utf-8 -*-
 
 import os
+import atexit
 import datetime
 import time
 
+import itertools
 import collections
 import contextlib
 import functools
 
-import pymongo
 import sqlite3
 
 import logging
 
-import multiprocessing
 import threading
 
 import math
+import zlib
+import hashlib
 
-from cacheer.serializer import serializer
+from cacheer.serializer import serializer, Chunks
 from cacheer.settings import conf
-from cacheer.utils import timeit
+from cacheer.pack import PackStore
+from cacheer.utils import timeit, after_fork
 
 LOG = logging.getLogger('cacheer.manager')
 
@@ -29,83 +32,219 @@ LOG = logging.getLogger('cacheer.manager')
 
 class LmdbStore:
     """
-    Deprecated
+    Cache store over an LMDB environment, values and meta in separate
+    databases
+
+    Each process keeps one environment open. Values are deserialized
+    straight from the memory map inside the read transaction, and copied
+    out first only if what they decode to would keep referring to it
+    (Arrow tables, out-of-band pickles). `write_batch` applies its ops in
+    one transaction. The map grows by doubling when full, readers of this
+    process being let out before it's remapped.
     """
 
-    def __init__(self):
-
+    def __init__(self, db_path=None, map_size=None):
         import lmdb
 
-        self.db_path = db_path = conf['lmdb-uri']
-        if not db_path:
+        self.db_path = db_path or conf.get('lmdb-uri')
+        if not self.db_path:
             try:
-                db_path = os.path.join(os.path.dirname(__file__), 'lmdb')
+                self.db_path = os.path.join(os.path.dirname(__file__), 'lmdb')
             except NameError:  # so it would work in python shell
-                db_path = os.path.join(os.path.realpath(''), 'lmdb')
+                self.db_path = os.path.join(os.path.realpath(''), 'lmdb')
 
-        self.map_size = map_size = conf['map-size'] or 1024 * 1024 * 10
-
-        self._envs = {}
+        self.map_size = map_size or conf.get('map-size') or 1024 ** 3
+        self.max_readers = conf.get('lmdb-max-readers', 1024)
+        self._cache_meta_prefix = '__cache_meta_'
 
-        # init lmdb
-        env = lmdb.open(db_path, map_size=map_size)
-        env.close()
-        # self._env = lmdb.open(db_path, map_size=map_size, readonly=True)
+        self._pid = None
+        self._cond = threading.Condition()
+        self._active = 0
+        self._resizing = False
 
     @property
     def _env(self):
-        pid = os.getpid()
-        if pid not in self._envs:
-            self._envs[pid] = lmdb.open(self.db_path,
-                                        map_size=self.map_size,
-                                        readonly=True)
-        return self._envs[pid]
-
-    def __enter__(self):
-        pass
+        if self._pid != os.getpid():
+            import lmdb
+
+            if self._pid is not None:
+                # inherited through fork, only this process' readers are
+                # released by closing it
+                self._env_.close()
+                self._cond = threading.Condition()
+                self._active, self._resizing = 0, False
+            self._env_ = lmdb.open(
+                self.db_path, map_size=self.map_size, max_dbs=2,
+                max_readers=self.max_readers, readahead=False)
+            self._values = self._env_.open_db(b'values')
+            self._meta = self._env_.open_db(b'meta')
+            self._pid = os.getpid()
+        return self._env_
 
-    def __exit__(self, *args, **kw):
-        pass
+    @contextlib.contextmanager
+    def _txn(self, write=False):
+        import lmdb
 
-    def write(self, key, value):
-        # self._write(key, value, env=self._write_env)
-        worker = multiprocessing.Process
-        worker(target=self._write, args=(key, value)).start()
+        env = self._env
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._resizing)
+                self._active += 1
+            try:
+                try:
+                    txn = env.begin(write=write, buffers=True)
+                except lmdb.MapResizedError:  # grown by another process
+                    pass
+                else:
+                    with txn:
+                        yield txn
+                    return
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+            self._resize(grow=False)
+
+    def _resize(self, grow=True):
+        with self._cond:
+            if self._resizing:
+                self._cond.wait_for(lambda: not self._resizing)
+                return
+            self._resizing = True
+            self._cond.wait_for(lambda: self._active == 0)
+        try:
+            env = self._env
+            size = env.info()['map_size'] * 2 if grow else 0
+            env.set_mapsize(size)  # 0 adopts the size set by others
+            if grow:
+                LOG.info('LMDB map of %s grown to %d bytes',
+                         self.db_path, size)
+        finally:
+            with self._cond:
+                self._resizing = False
+                self._cond.notify_all()
+
+    def _update(self, apply):
+        import lmdb
 
-    def _write(self, key, value, env=None):
-        env = env or lmdb.open(
-            self.db_path, map_size=self.map_size)
+        while True:
+            try:
+                with self._txn(write=True) as txn:
+                    return apply(txn)
+            except lmdb.MapFullError:
+                self._resize()
 
+    @staticmethod
+    def _load(buf):
+        if serializer.borrows(buf):
+            buf = bytes(buf)
+        return serializer.deserialize(buf)
+
+    def read(self, key):
+        with self._txn() as txn:
+            buf = txn.get(key.encode(), db=self._values)
+            return None if buf is None else self._load(buf)
+
+    def read_raw(self, key):
+        """
+        Stored bytes of `key`, not deserialized
+        """
+        with self._txn() as txn:
+            buf = txn.get(key.encode(), db=self._values)
+            return None if buf is None else bytes(buf)
+
+    def read_partial(self, key, columns=None, filter=None):
+        """
+        Like `read`, but only loads `columns`/rows matching `filter` of a
+        stored DataFrame or Arrow table
+        """
+        with self._txn() as txn:
+            buf = txn.get(key.encode(), db=self._values)
+            if buf is None:
+                return None
+            if serializer.borrows(buf):
+                buf = bytes(buf)
+            return serializer.deserialize_partial(
+                buf, columns=columns, filter=filter)
+
+    @staticmethod
+    def _bytes(value):
         b_value = serializer.serialize(value)
-        value_hash = serializer.gen_md5(b_value)
-        with env.begin(write=True) as txn:
-            txn.put(key.encode(), b_value)
+        if isinstance(b_value, Chunks):
+            b_value = b_value.tobytes()
+        return b_value
 
-        env.close()
-        return value_hash
+    def write(self, key, value):
+        b_value = self._bytes(value)
+        self._update(
+            lambda txn: txn.put(key.encode(), b_value, db=self._values))
 
-    def read(self, key):
-        with self._env.begin() as txn:
-            value = txn.get(key.encode())
-        if value is not None:
-            return serializer.deserialize(value)
+    def has_key(self, key):
+        with self._txn() as txn:
+            return txn.get(key.encode(), db=self._values) is not None
 
     def delete(self, key):
-        # self._delete(key, env=self._write_env)
-        worker = multiprocessing.Process
-        worker(target=self._delete, args=(key,)).start()
+        self._update(lambda txn: txn.delete(key.encode(), db=self._values))
+
+    def keys(self):
+        with self._txn() as txn:
+            return [bytes(k).decode() for k in
+                    txn.cursor(db=self._values).iternext(values=False)]
+
+    def usage(self):
+        """
+        Bytes of pages holding values
+        """
+        with self._txn() as txn:
+            stat = txn.stat(self._values)
+        return stat['psize'] * (stat['branch_pages'] + stat['leaf_pages'] +
+                                stat['overflow_pages'])
+
+    def read_meta(self, key):
+        with self._txn() as txn:
+            buf = txn.get(key.encode(), db=self._meta)
+            return None if buf is None else self._load(buf)
 
-    def _delete(self, key, env=None):
-        env = env or lmdb.open(
-            self.db_path, map_size=self.map_size)
+    def read_all_meta(self):
+        with self._txn() as txn:
+            return {self._cache_meta_prefix + bytes(k).decode(): self._load(v)
+                    for k, v in txn.cursor(db=self._meta)}
 
-        with env.begin(write=True) as txn:
-            txn.delete(key.encode())
+    def write_meta(self, key, meta):
+        b_meta = self._bytes(meta)
+        self._update(lambda txn: txn.put(key.encode(), b_meta, db=self._meta))
 
-        env.close()
+    def delete_meta(self, key):
+        self._update(lambda txn: txn.delete(key.encode(), db=self._meta))
+
+    def write_batch(self, ops):
+        """
+        Apply `(op, key, value)` ops, op being one of write, write_meta,
+        delete, delete_meta, in a single transaction
+        """
+        ops = [(op, key.encode(), None if value is None else
+                self._bytes(value)) for op, key, value in ops]
+
+        def apply(txn):
+            for op, key, value in ops:
+                if op == 'write':
+                    txn.put(key, value, db=self._values)
+                elif op == 'write_meta':
+                    txn.put(key, value, db=self._meta)
+                elif op == 'delete':
+                    txn.delete(key, db=self._values)
+                elif op == 'delete_meta':
+                    txn.delete(key, db=self._meta)
+                else:
+                    raise ValueError('unknown op {}'.format(op))
+
+        self._update(apply)
 
     def close(self):
-        self._env.close()
+        if self._pid == os.getpid():
+            self._env_.close()
+        self._pid = None
+        self.__dict__.pop('_env_', None)
 
 
 class MetaDB:
@@ -125,6 +264,12 @@ class MetaDB:
     def update(self, block_id, meta):
         raise NotImplementedError
 
+    def preload(self):
+        """
+        Load what lookups need up front, e.g. before forking workers
+        """
+        pass
+
 
 class MongoMetaDB(MetaDB):
 
@@ -146,6 +291,7 @@ class MongoMetaDB(MetaDB):
         self._api_map_first_loading = False
 
     def read_update_status(self):
+        import pymongo
         update_stats = {}
         for uri in self._metadb_uris:
             with pymongo.MongoClient(uri) as cl:
@@ -170,6 +316,7 @@ class MongoMetaDB(MetaDB):
 
     @contextlib.contextmanager
     def _open_mongo(self, ns):
+        import pymongo
         db_name, coll_name = ns.split('.', 1)
         client = pymongo.MongoClient(self._metadb_uris[0])
         coll = client[db_name][coll_name]
@@ -195,6 +342,15 @@ class MongoMetaDB(MetaDB):
             docs = list(coll.find())
         self._api_map = {doc['api_name']: doc for doc in docs}
 
+    def preload(self):
+        """
+        Load the api map and latest update status, for processes forked
+        afterwards to share them until the next refresh
+        """
+        self.load_api_map()
+        self._api_map_first_loading = True
+        self._refresh_update_status()
+
     def get_block_id(self, api_id):
         if not self._api_map_first_loading:
             self.load_api_map()
@@ -242,6 +398,7 @@ class MongoMetaDB(MetaDB):
         if coll is not None:
             _update(coll)
         else:
+            import pymongo
             with pymongo.MongoClient(self._metadb_uris[db_num]) as cl:
                 coll = cl.get_database()[self._status_coll_name]
                 _update(coll)
@@ -298,6 +455,14 @@ class SqliteStore(object):
 
         self._indexed_fields = collections.OrderedDict()
         self._conns = {}
+        self._inherited_conns = []
+        after_fork(self, '_drop_inherited_conns')
+
+        # e.g. 'WAL', for readers not to wait on writers
+        self.journal_mode = None
+        # e.g. 'INCREMENTAL', applies to tables created afterwards, or once
+        # the file is vacuumed
+        self.auto_vacuum = None
 
         self._db_initialized = False
 
@@ -317,6 +482,10 @@ class SqliteStore(object):
         if conn_id not in self._conns:
             self._conns[conn_id] = conn = sqlite3.connect(
                 self.db_name + '.db')
+            if self.journal_mode:
+                conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+            if self.auto_vacuum:
+                conn.execute(f'PRAGMA auto_vacuum={self.auto_vacuum}')
 
             def dict_factory(cursor, row):
                 d = {}
@@ -328,6 +497,13 @@ class SqliteStore(object):
 
         return self._conns[conn_id]
 
+    def _drop_inherited_conns(self):
+        # connections of the parent can't be used in a forked child, nor
+        # closed, which could roll back a transaction of the parent; they
+        # are only kept from being garbage collected
+        self._inherited_conns.extend(self._conns.values())
+        self._conns = {}
+
     def close(self):
         # self._conn.commit()
         self._conns.clear()
@@ -503,21 +679,56 @@ class SqliteCacheStore(object):
         self._store = SqliteStore(
             self.db_path, 'lab_cache', ['key', 'value'])
         self._store.add_index('key', unique=True)
+        self._store.journal_mode = conf.get('sqlite-journal-mode')
+        self._store.auto_vacuum = conf.get('sqlite-auto-vacuum',
+                                           'INCREMENTAL')
         self._cache_meta_prefix = '__cache_meta_'
 
     def read(self, key):
-        res = self._store.read({'key': key}, limit=1)
-        assert len(res) <= 1
+        b_value = self._read_raw(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize(b_value)
 
-        if len(res) == 0:
+    def read_partial(self, key, columns=None, filter=None):
+        """
+        Like `read`, but only loads `columns`/rows matching `filter` of a
+        stored DataFrame or Arrow table, reading just the needed parts of
+        the blob where the stored format allows it
+        """
+        with self._store._conn:
+            res = self._store._conn.execute(
+                "SELECT ID, typeof(value) AS type FROM lab_cache"
+                " WHERE key = ? LIMIT 1", (key,)).fetchone()
+
+        if res is None:
             return None
 
-        b_value = res[0]['value']
+        if res['type'] == 'integer' or not hasattr(
+                sqlite3.Connection, 'blobopen'):
+            return serializer.deserialize_partial(
+                self._read_raw(key), columns=columns, filter=filter)
 
+        # pyarrow reads the blob from its own threads, through a
+        # connection of this read only
+        conn = sqlite3.connect(self._store.db_name + '.db',
+                               check_same_thread=False)
+        try:
+            with conn.blobopen('lab_cache', 'value', res['ID'],
+                               readonly=True) as blob:
+                return serializer.deserialize_partial(
+                    blob, columns=columns, filter=filter)
+        finally:
+            conn.close()
+
+    def _read_raw(self, key):
+        res = self._store.read({'key': key}, limit=1)
+        if len(res) == 0:
+            return None
+        b_value = res[0]['value']
         if isinstance(b_value, int):  # splited
             b_value = self._read_split_blob(key, b_value)
-
-        return serializer.deserialize(b_value)
+        return b_value
 
     def _write_or_update(self, key, value):
         try:
@@ -532,19 +743,60 @@ class SqliteCacheStore(object):
 
     def write(self, key, value):
         b_value = serializer.serialize(value)
-        value_len = len(b_value)
+        if isinstance(b_value, Chunks):
+            value_len = b_value.nbytes
+        else:
+            value_len = len(b_value)
         if value_len > self._store._max_length:
-            self._split_blob_and_save(value, value_len, key)
+            self._split_blob_and_save(b_value, value_len, key)
+        elif isinstance(b_value, Chunks):
+            self._write_chunks(key, b_value, value_len)
         else:
             self._write_or_update(key, b_value)
 
+    def _write_chunks(self, key, chunks, length):
+        # write parts straight into a zeroblob, without joining them first
+        if not hasattr(sqlite3.Connection, 'blobopen'):  # python < 3.11
+            return self._write_or_update(key, chunks.tobytes())
+
+        conn = self._store._conn
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO lab_cache (key, value) VALUES (?, zeroblob(?))"
+                    " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, length))
+                rowid = conn.execute(
+                    "SELECT ID FROM lab_cache WHERE key = ?",
+                    (key,)).fetchone()['ID']
+                with conn.blobopen('lab_cache', 'value', rowid) as blob:
+                    for part in chunks:
+                        blob.write(part)
+        except sqlite3.OperationalError as e:
+            self._store.reset_connection(exc=e)
+            self._write_or_update(key, chunks.tobytes())
+
+    @staticmethod
+    def _slice_chunks(chunks, start, stop):
+        sub, offset = Chunks(), 0
+        for part in chunks:
+            part = memoryview(part).cast('B')
+            end = offset + part.nbytes
+            if end > start and offset < stop:
+                sub.append(part[max(start - offset, 0):stop - offset])
+            offset = end
+        return sub
+
     def _split_blob_and_save(self, blob, length, key):
         number = math.ceil(length / self._store._max_length)
         step = math.ceil(length / number)
         for idx, i in enumerate(range(0, length, step)):
-            sub = blob[i:i+step]
             sub_key = f'{key}_{idx}'
-            self._write_or_update(sub_key, sub)
+            if isinstance(blob, Chunks):
+                sub = self._slice_chunks(blob, i, i + step)
+                self._write_chunks(sub_key, sub, sub.nbytes)
+            else:
+                self._write_or_update(sub_key, blob[i:i+step])
 
         self._write_or_update(key, number)
 
@@ -565,7 +817,87 @@ class SqliteCacheStore(object):
                 f" = '{key}' LIMIT 1").fetchone()
         return ret is not None
 
+    def keys(self):
+        return [i['key'] for i in self._store.read_distinct(['key'])]
+
+    def read_raw(self, key):
+        """
+        Stored bytes of `key`, not deserialized
+        """
+        return self._read_raw(key)
+
+    def usage(self):
+        """
+        Bytes of stored values, meta excluded
+        """
+        row = self._store._conn.execute(
+            "SELECT TOTAL(length(value)) AS size FROM lab_cache"
+            " WHERE key NOT LIKE '__cache_meta%'").fetchone()
+        return int(row['size'])
+
+    def coldest(self, n):
+        """
+        (key, size) of the `n` values stored first
+        """
+        rows = self._store._conn.execute(
+            "SELECT key, length(value) AS size FROM lab_cache"
+            " WHERE key NOT LIKE '__cache_meta%' AND key NOT GLOB '*_[0-9]*'"
+            " ORDER BY ID LIMIT ?", (n,)).fetchall()
+        return [(row['key'], row['size']) for row in rows]
+
+    def close(self):
+        self._store.close()
+
+    def _pragma(self, name):
+        return list(self._store._conn.execute(
+            f'PRAGMA {name}').fetchone().values())[0]
+
+    def file_size(self):
+        return self._pragma('page_count') * self._pragma('page_size')
+
+    def free_bytes(self):
+        """
+        Bytes of free pages, left by deleted or overwritten values
+        """
+        return self._pragma('freelist_count') * self._pragma('page_size')
+
+    def incremental_vacuum(self, pages=1024):
+        """
+        Give back up to `pages` free pages to the file system, returning
+        the bytes reclaimed
+
+        Only effective once the file is in incremental auto-vacuum mode,
+        from its creation or after `compact`.
+        """
+        if self._pragma('auto_vacuum') != 2:  # incremental
+            return 0
+        before = self.free_bytes()
+        # a script, as execute would only step through the first page
+        self._store._conn.executescript(
+            f'PRAGMA incremental_vacuum({int(pages)})')
+        return before - self.free_bytes()
+
+    def compact(self):
+        """
+        Rewrite the file with its values contiguous and no free pages,
+        in the configured auto-vacuum mode, while no one else writes
+
+        Returns the file size before and after, and seconds taken.
+        """
+        started = time.time()
+        before = self.file_size()
+        conn = self._store._conn
+        if self._store.auto_vacuum:
+            conn.execute(f'PRAGMA auto_vacuum={self._store.auto_vacuum}')
+        conn.execute('VACUUM')
+        return {'size_before': before, 'size_after': self.file_size(),
+                'seconds': time.time() - started}
+
     def delete(self, key):
+        res = self._store.read({'key': key}, limit=1)
+        if res and isinstance(res[0]['value'], int):  # splited
+            for i in range(res[0]['value']):
+                self._store.delete({'key': f'{key}_{i}'})
         self._store.delete({'key': key})
 
     def read_meta(self, key):
@@ -585,3 +917,756 @@ class SqliteCacheStore(object):
     def delete_meta(self, key):
         meta_key = self._cache_meta_prefix + key
         self.delete(meta_key)
+
+    def write_batch(self, ops):
+        """
+        Apply `(op, key, value)` ops, op being one of write, write_meta,
+        delete, delete_meta, in a single transaction
+
+        Values too large for one blob are written separately afterwards.
+        """
+        large = []
+        conn = self._store._conn
+        with conn:
+            for op, key, value in ops:
+                if op.endswith('_meta'):
+                    key = self._cache_meta_prefix + key
+                if op.startswith('delete'):
+                    conn.execute("DELETE FROM lab_cache WHERE key = ?",
+                                 (key,))
+                    continue
+                b_value = serializer.serialize(value)
+                if isinstance(b_value, Chunks):
+                    b_value = (b_value[0] if len(b_value) == 1
+                               else b_value.tobytes())
+                if memoryview(b_value).nbytes > self._store._max_length:
+                    large.append((key, Chunks([b_value])))
+                    continue
+                conn.execute(
+                    "INSERT INTO lab_cache (key, value) VALUES (?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, b_value))
+        for key, b_value in large:
+            self.write(key, b_value)
+
+
+class ChunkedCacheStore(SqliteCacheStore):
+    """
+    SqliteCacheStore keeping values as lists of content-defined chunks
+
+    Chunks are stored once by md5 in `lab_cache_chunks` with a reference
+    count, so values sharing most of their bytes (overlapping ranges, one
+    changed column) share their storage too. Meta is stored as usual.
+    """
+
+    MAGIC = b'CCDC'
+    DIGEST_SIZE = 16
+
+    def __init__(self, db_path=None, avg_chunk_size=None):
+        super().__init__(db_path)
+        self.avg_chunk_size = avg_chunk_size or conf.get(
+            'chunk-size', 64 * 1024)
+        self._chunks_ready = False
+
+    @property
+    def _conn(self):
+        conn = self._store._conn
+        if not self._chunks_ready:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS lab_cache_chunks ("
+                    "ID INTEGER PRIMARY KEY, hash BLOB UNIQUE, "
+                    "refs INTEGER, data BLOB)")
+            self._chunks_ready = True
+        return conn
+
+    def _manifest(self, key):
+        b_value = self._read_raw(key)
+        if b_value is None or bytes(b_value[:4]) != self.MAGIC:
+            return None, b_value
+        size = self.DIGEST_SIZE
+        return [b_value[i:i + size]
+                for i in range(4, len(b_value), size)], b_value
+
+    def _release(self, conn, digests):
+        conn.executemany(
+            "UPDATE lab_cache_chunks SET refs = refs - 1 WHERE hash = ?",
+            [(d,) for d in digests])
+        conn.execute("DELETE FROM lab_cache_chunks WHERE refs <= 0")
+
+    def write(self, key, value):
+        from cacheer import chunking
+
+        b_value = serializer.serialize(value)
+        if isinstance(b_value, Chunks):
+            b_value = b_value.tobytes()
+
+        parts = chunking.split(b_value, self.avg_chunk_size)
+        digests = [hashlib.md5(part).digest() for part in parts]
+        old, _ = self._manifest(key)
+
+        conn = self._conn
+        with conn:
+            conn.executemany(
+                "INSERT INTO lab_cache_chunks (hash, refs, data)"
+                " VALUES (?, 1, ?)"
+                " ON CONFLICT(hash) DO UPDATE SET refs = refs + 1",
+                zip(digests, parts))
+            if old:
+                self._release(conn, old)
+            conn.execute(
+                "INSERT INTO lab_cache (key, value) VALUES (?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, self.MAGIC + b''.join(digests)))
+
+    def _read_raw_chunked(self, key):
+        digests, b_value = self._manifest(key)
+        if digests is None:
+            return b_value
+
+        data = {}
+        for i in range(0, len(digests), 500):
+            batch = list(set(digests[i:i + 500]))
+            rows = self._conn.execute(
+                "SELECT hash, data FROM lab_cache_chunks WHERE hash IN"
+                " ({})".format(','.join('?' * len(batch))),
+                batch).fetchall()
+            data.update((row['hash'], row['data']) for row in rows)
+        return b''.join(data[d] for d in digests)
+
+    def read_raw(self, key):
+        return self._read_raw_chunked(key)
+
+    def read(self, key):
+        b_value = self._read_raw_chunked(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize(b_value)
+
+    def read_partial(self, key, columns=None, filter=None):
+        b_value = self._read_raw_chunked(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize_partial(
+            b_value, columns=columns, filter=filter)
+
+    def delete(self, key):
+        old, _ = self._manifest(key)
+        conn = self._conn
+        with conn:
+            if old:
+                self._release(conn, old)
+            conn.execute("DELETE FROM lab_cache WHERE key = ?", (key,))
+
+    def write_meta(self, key, meta):
+        SqliteCacheStore.write(self, self._cache_meta_prefix + key, meta)
+
+    def delete_meta(self, key):
+        self._store.delete({'key': self._cache_meta_prefix + key})
+
+    def write_batch(self, ops):
+        # each write already runs in its own transaction
+        for op, key, value in ops:
+            if op.startswith('delete'):
+                getattr(self, op)(key)
+            else:
+                getattr(self, op)(key, value)
+
+    def usage(self):
+        return self.dedup_stats()['stored_bytes']
+
+    def coldest(self, n):
+        """
+        (key, size) of the `n` values stored first, size being the bytes
+        of the chunks no other value refers to, freed by deleting it
+        """
+        coldest = []
+        for key, _ in super().coldest(n):
+            digests, b_value = self._manifest(key)
+            if digests is None:  # stored whole
+                coldest.append((key, len(b_value or b'')))
+                continue
+            counts = collections.Counter(bytes(d) for d in digests)
+            size = 0
+            batch = list(counts)
+            for j in range(0, len(batch), 500):
+                rows = self._conn.execute(
+                    "SELECT hash, refs, length(data) AS size"
+                    " FROM lab_cache_chunks WHERE hash IN ({})".format(
+                        ','.join('?' * len(batch[j:j + 500]))),
+                    batch[j:j + 500]).fetchall()
+                size += sum(row['size'] for row in rows
+                            if row['refs'] <= counts[bytes(row['hash'])])
+            coldest.append((key, size))
+        return coldest
+
+    def dedup_stats(self):
+        """
+        Bytes referenced by stored values against bytes actually stored
+        """
+        row = self._conn.execute(
+            "SELECT COUNT(*) AS chunks, TOTAL(length(data)) AS stored,"
+            " TOTAL(length(data) * refs) AS referenced"
+            " FROM lab_cache_chunks").fetchone()
+        return {'chunks': row['chunks'], 'stored_bytes': int(row['stored']),
+                'referenced_bytes': int(row['referenced'])}
+
+
+class ShardedCacheStore(object):
+    """
+    Keys partitioned by hash prefix across `shards` sqlite files, each with
+    its own connections and lock, so writers of different keys don't wait
+    on each other
+
+    Shard files are named after the shard count (`{db_path}-3-of-8.db`),
+    so changing it starts from empty shards rather than misrouting keys.
+    """
+
+    def __init__(self, db_path=None, shards=None, store_class=None):
+        self.db_path = db_path or conf['sqlite-uri']
+        self.n_shards = n = shards or conf.get('cache-shards', 8)
+        store_class = store_class or SqliteCacheStore
+        self.shards = [store_class(f'{self.db_path}-{i}-of-{n}')
+                       for i in range(n)]
+        self._cache_meta_prefix = self.shards[0]._cache_meta_prefix
+
+    def _shard(self, key):
+        try:
+            h = int(key[:8], 16)
+        except ValueError:
+            h = zlib.crc32(key.encode())
+        return self.shards[h % self.n_shards]
+
+    def read(self, key):
+        return self._shard(key).read(key)
+
+    def read_raw(self, key):
+        return self._shard(key).read_raw(key)
+
+    def read_partial(self, key, columns=None, filter=None):
+        shard = self._shard(key)
+        if hasattr(shard, 'read_partial'):
+            return shard.read_partial(key, columns=columns, filter=filter)
+        from cacheer.serializer import project
+        return project(shard.read(key), columns=columns, filter=filter)
+
+    def write(self, key, value):
+        self._shard(key).write(key, value)
+
+    def has_key(self, key):
+        return self._shard(key).has_key(key)
+
+    def delete(self, key):
+        self._shard(key).delete(key)
+
+    def keys(self):
+        return [k for shard in self.shards for k in shard.keys()]
+
+    def usage(self):
+        return sum(shard.usage() for shard in self.shards)
+
+    def free_bytes(self):
+        return sum(shard.free_bytes() for shard in self.shards)
+
+    def incremental_vacuum(self, pages=1024):
+        return sum(shard.incremental_vacuum(pages) for shard in self.shards)
+
+    def compact(self):
+        stats = [shard.compact() for shard in self.shards]
+        return {k: sum(stat[k] for stat in stats) for k in stats[0]}
+
+    def coldest(self, n):
+        per_shard = -(-n // self.n_shards)
+        return [item for shard in self.shards
+                for item in shard.coldest(per_shard)]
+
+    def read_meta(self, key):
+        return self._shard(key).read_meta(key)
+
+    def read_all_meta(self):
+        meta = {}
+        for shard in self.shards:
+            meta.update(shard.read_all_meta())
+        return meta
+
+    def write_meta(self, key, meta):
+        self._shard(key).write_meta(key, meta)
+
+    def delete_meta(self, key):
+        self._shard(key).delete_meta(key)
+
+    def write_batch(self, ops):
+        by_shard = collections.defaultdict(list)
+        for op in ops:
+            by_shard[id(self._shard(op[1]))].append(op)
+        for shard in self.shards:
+            if id(shard) in by_shard:
+                _write_batch(shard, by_shard[id(shard)])
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+class MemoryCacheStore(object):
+    """
+    In-process LRU of serialized values bounded by `max_bytes`, with the
+    store interface
+
+    Meta is kept apart, unbounded, as it is small.
+    """
+
+    def __init__(self, max_bytes=None, on_evict=None):
+        self.max_bytes = max_bytes or conf.get('memory-bytes', 1024 ** 3)
+        # called with the key and bytes of values evicted
+        self.on_evict = on_evict
+        self.nbytes = 0
+        self._values = collections.OrderedDict()
+        self._meta = {}
+        self._lock = threading.Lock()
+        self._cache_meta_prefix = '__cache_meta_'
+
+    def read_raw(self, key):
+        with self._lock:
+            b_value = self._values.get(key)
+            if b_value is not None:
+                self._values.move_to_end(key)
+        return b_value
+
+    def read(self, key):
+        b_value = self.read_raw(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize(b_value)
+
+    def read_partial(self, key, columns=None, filter=None):
+        b_value = self.read_raw(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize_partial(
+            b_value, columns=columns, filter=filter)
+
+    def write(self, key, value):
+        b_value = serializer.serialize(value)
+        if isinstance(b_value, Chunks):
+            b_value = (b_value[0] if len(b_value) == 1
+                       else b_value.tobytes())
+        size = memoryview(b_value).nbytes
+        evicted = []
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self.nbytes -= memoryview(old).nbytes
+            if size > self.max_bytes:
+                evicted.append((key, b_value))
+            else:
+                self._values[key] = b_value
+                self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                item = self._values.popitem(last=False)
+                self.nbytes -= memoryview(item[1]).nbytes
+                evicted.append(item)
+        if self.on_evict is not None:
+            for item in evicted:
+                self.on_evict(*item)
+
+    def has_key(self, key):
+        return key in self._values
+
+    def delete(self, key):
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self.nbytes -= memoryview(old).nbytes
+
+    def keys(self):
+        return list(self._values)
+
+    def usage(self):
+        return self.nbytes
+
+    def coldest(self, n):
+        with self._lock:
+            return [(k, memoryview(v).nbytes) for k, v in
+                    itertools.islice(self._values.items(), n)]
+
+    def read_meta(self, key):
+        meta = self._meta.get(key)
+        return None if meta is None else dict(meta)
+
+    def read_all_meta(self):
+        return {self._cache_meta_prefix + k: dict(v)
+                for k, v in list(self._meta.items())}
+
+    def write_meta(self, key, meta):
+        if not isinstance(meta, dict):  # serialized
+            if isinstance(meta, Chunks):
+                meta = meta.tobytes()
+            meta = serializer.deserialize(meta)
+        self._meta[key] = dict(meta)
+
+    def delete_meta(self, key):
+        self._meta.pop(key, None)
+
+    def close(self):
+        pass
+
+
+class TieredStore(object):
+    """
+    Stores stacked fastest first, behind the store interface
+
+    Reads go down the tiers and copy a value found in a lower tier to the
+    tiers above it. Values are written to `write_tiers` (all by default),
+    or with `write_back` to the first one only, reaching lower tiers when
+    demoted, or on `flush`. A tier with a `budgets` entry demotes its
+    oldest values to the next tier (least recently used for memory tiers)
+    once it holds more bytes than that, the last tier dropping them.
+    Meta is written to all write tiers and the last tier, with `write_back`
+    to the last tier only once the values it refers to left the first one.
+    Read-only tiers, e.g. packs, are never written to.
+
+    Tiers default to `cache-tiers` in config, e.g.
+
+        cache-tiers:
+            - store: memory
+              max-bytes: 1073741824
+            - store: sqlite
+              path: /ssd/cacheer
+              max-bytes: 107374182400
+            - store: sharded
+              path: /nfs/cacheer
+        cache-tiers-write: back
+    """
+
+    def __init__(self, tiers=None, budgets=None, write_tiers=None,
+                 write_back=None):
+        if tiers is None:
+            tiers, budgets = self._tiers_from_config()
+        if write_back is None:
+            write_back = conf.get('cache-tiers-write', 'through') == 'back'
+
+        self.tiers = list(tiers)
+        self.budgets = list(budgets or [None] * len(self.tiers))
+        self.write_back = write_back
+        if write_back:
+            self.write_tiers = [0]
+        else:
+            self.write_tiers = list(write_tiers or range(len(self.tiers)))
+        self._cache_meta_prefix = '__cache_meta_'
+
+        self._usage = [None] * len(self.tiers)
+        self._usage_time = [0] * len(self.tiers)
+        self._dirty = set()
+        # with write_back, meta key -> (meta, values still in the first
+        # tier only), and value key -> meta keys waiting for it
+        self._meta_pending = {}
+        self._meta_waiting = collections.defaultdict(set)
+        self._lock = threading.RLock()
+
+        for i, tier in enumerate(self.tiers):
+            if isinstance(tier, MemoryCacheStore):
+                if self.budgets[i]:
+                    tier.max_bytes = self.budgets[i]
+                self.budgets[i] = None  # evicts by itself
+                tier.on_evict = functools.partial(self._demote, i)
+
+        if write_back:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _tiers_from_config():
+        tiers, budgets = [], []
+        for spec in conf.get('cache-tiers') or []:
+            name, budget = spec['store'], spec.get('max-bytes')
+            if name == 'memory':
+                tiers.append(MemoryCacheStore(budget))
+            else:
+                tiers.append(CACHE_STORES[name](spec.get('path')))
+            budgets.append(budget)
+        if not tiers:
+            raise ValueError('no cache-tiers in config')
+        return tiers, budgets
+
+    def _read_raw_from(self, tier, key):
+        if hasattr(tier, 'read_raw'):
+            return tier.read_raw(key)
+        value = tier.read(key)
+        return None if value is None else serializer.serialize(value)
+
+    def read_raw(self, key):
+        for i, tier in enumerate(self.tiers):
+            b_value = self._read_raw_from(tier, key)
+            if b_value is None:
+                continue
+            for upper in range(i - 1, -1, -1):  # promote
+                self._write_tier(upper, key, b_value)
+            return b_value
+        return None
+
+    def read(self, key):
+        b_value = self.read_raw(key)
+        if b_value is None:
+            return None
+        return serializer.deserialize(b_value)
+
+    def read_partial(self, key, columns=None, filter=None):
+        for tier in self.tiers:
+            if tier.has_key(key):
+                if hasattr(tier, 'read_partial'):
+                    return tier.read_partial(
+                        key, columns=columns, filter=filter)
+                from cacheer.serializer import project
+                return project(tier.read(key), columns=columns,
+                               filter=filter)
+        return None
+
+    def _write_tier(self, i, key, b_value):
+        if getattr(self.tiers[i], 'read_only', False):
+            return
+        self.tiers[i].write(key, Chunks([b_value]))
+        budget = self.budgets[i]
+        if budget is None:
+            return
+        with self._lock:
+            now = time.time()
+            if self._usage[i] is None or now - self._usage_time[i] > 60:
+                # picks up writes of other processes
+                self._usage[i] = self.tiers[i].usage()
+                self._usage_time[i] = now
+            else:
+                self._usage[i] += memoryview(b_value).nbytes
+            if self._usage[i] > budget:
+                self._shrink(i, budget)
+
+    def _shrink(self, i, budget):
+        # demote the oldest values until 90% of the budget is used, usage
+        # being read again after each batch as the sizes given by
+        # `coldest` are only estimates of the bytes freed
+        tier = self.tiers[i]
+        target = budget * 0.9
+        usage = tier.usage()
+        while usage > target:
+            coldest = tier.coldest(64)
+            if not coldest:
+                break
+            for key, size in coldest:
+                b_value = self._read_raw_from(tier, key)
+                tier.delete(key)
+                if b_value is not None:
+                    self._demote(i, key, b_value)
+                usage -= size or 0
+                if usage <= target:
+                    break
+            usage = tier.usage()
+        self._usage[i] = usage
+
+    def _demote(self, i, key, b_value):
+        below = i + 1
+        if below < len(self.tiers) and not self.tiers[below].has_key(key):
+            self._write_tier(below, key, b_value)
+        self._dirty.discard(key)
+        if below < len(self.tiers):
+            self._release_meta(key)
+
+    def _meta_tiers(self):
+        tiers = sorted(set(self.write_tiers) | {len(self.tiers) - 1})
+        return [i for i in tiers
+                if not getattr(self.tiers[i], 'read_only', False)]
+
+    def _stored_below(self, key):
+        return key not in self._dirty and any(
+            tier.has_key(key) for tier in self.tiers[1:])
+
+    def _release_meta(self, key):
+        # write meta held back for the value of `key`, now below the first
+        # tier, to the lower tiers once all its values are
+        with self._lock:
+            ready = []
+            for meta_key in self._meta_waiting.pop(key, ()):
+                meta, pending = self._meta_pending[meta_key]
+                pending.discard(key)
+                if not pending:
+                    del self._meta_pending[meta_key]
+                    ready.append((meta_key, meta))
+        for meta_key, meta in ready:
+            for i in self._meta_tiers():
+                if i != 0:
+                    self.tiers[i].write_meta(meta_key, meta)
+
+    def write(self, key, value):
+        b_value = serializer.serialize(value)
+        if isinstance(b_value, Chunks):
+            b_value = b_value.tobytes()
+        for i in self.write_tiers:
+            self._write_tier(i, key, b_value)
+        if self.write_back:
+            self._dirty.add(key)
+
+    def flush(self):
+        """
+        Write values only held by the first tier to the next one
+        """
+        for key in list(self._dirty):
+            b_value = self._read_raw_from(self.tiers[0], key)
+            if b_value is not None:
+                self._demote(0, key, b_value)
+            self._dirty.discard(key)
+
+    def has_key(self, key):
+        return any(tier.has_key(key) for tier in self.tiers)
+
+    def _writable(self):
+        return [tier for tier in self.tiers
+                if not getattr(tier, 'read_only', False)]
+
+    def delete(self, key):
+        for tier in self._writable():
+            tier.delete(key)
+        self._dirty.discard(key)
+
+    def keys(self):
+        keys = set()
+        for tier in self.tiers:
+            keys.update(tier.keys())
+        return list(keys)
+
+    def usage(self):
+        return sum(tier.usage() for tier in self.tiers)
+
+    def read_meta(self, key):
+        for i, tier in enumerate(self.tiers):
+            meta = tier.read_meta(key)
+            if meta is not None:
+                for upper in self.tiers[:i]:
+                    if not getattr(upper, 'read_only', False):
+                        upper.write_meta(key, meta)
+                return meta
+        return None
+
+    def read_all_meta(self):
+        meta = {}
+        for tier in reversed(self.tiers):
+            meta.update(tier.read_all_meta())
+        return meta
+
+    def write_meta(self, key, meta):
+        tiers = self._meta_tiers()
+        if self.write_back and isinstance(meta, dict):
+            from cacheer.quota import value_refs
+
+            self._forget_meta(key)
+            refs = value_refs(meta) or ()
+            pending = {k for k in refs if not self._stored_below(k)}
+            if pending:
+                with self._lock:
+                    self._meta_pending[key] = (meta, pending)
+                    for value_key in pending:
+                        self._meta_waiting[value_key].add(key)
+                tiers = [i for i in tiers if i == 0]
+        for i in tiers:
+            self.tiers[i].write_meta(key, meta)
+
+    def _forget_meta(self, key):
+        with self._lock:
+            item = self._meta_pending.pop(key, None)
+            for value_key in item[1] if item else ():
+                waiting = self._meta_waiting.get(value_key)
+                if waiting is not None:
+                    waiting.discard(key)
+                    if not waiting:
+                        del self._meta_waiting[value_key]
+
+    def delete_meta(self, key):
+        self._forget_meta(key)
+        for tier in self._writable():
+            tier.delete_meta(key)
+
+    def close(self):
+        for tier in self.tiers:
+            tier.close()
+
+
+class IdleCompactor:
+    """
+    Gives free pages of `store` back to the file system from a background
+    thread, `pages` at a time, once no write was noted (`touch`) for
+    `interval` seconds
+    """
+
+    def __init__(self, store, interval=60, pages=1024):
+        self.store = store
+        self.interval = interval
+        self.pages = pages
+        self.reclaimed = 0
+        self._pid = None
+        self._last_write = time.monotonic()
+
+    def touch(self):
+        self._last_write = time.monotonic()
+        if self._pid != os.getpid():  # not started, or forked
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, daemon=True,
+                             name='CacheCompactor').start()
+
+    def _run(self):
+        while True:
+            idle = time.monotonic() - self._last_write
+            if idle < self.interval:
+                time.sleep(self.interval - idle)
+                continue
+            try:
+                reclaimed = self.store.incremental_vacuum(self.pages)
+            except sqlite3.OperationalError:  # busy, retry later
+                reclaimed = 0
+            except Exception:
+                LOG.error('Incremental vacuum failed', exc_info=True)
+                return
+            if reclaimed:
+                self.reclaimed += reclaimed
+                LOG.debug('%d bytes of free pages reclaimed', reclaimed)
+            else:
+                time.sleep(self.interval)
+
+
+def _write_batch(store, ops):
+    if hasattr(store, 'write_batch'):
+        return store.write_batch(ops)
+    for op, key, value in ops:
+        if op.startswith('delete'):
+            getattr(store, op)(key)
+        else:
+            getattr(store, op)(key, value)
+
+
+CACHE_STORES = {
+    'sqlite': SqliteCacheStore,
+    'chunked': ChunkedCacheStore,
+    'sharded': ShardedCacheStore,
+    'memory': MemoryCacheStore,
+    'lmdb': LmdbStore,
+    'tiered': TieredStore,
+    'pack': PackStore,
+}
+
+
+def open_cache_store(name=None, remote=True):
+    """
+    Cache store named by `cache-store` in config, SqliteCacheStore by default
+
+    With `remote`, it is only used while the cache server at
+    `server-socket`, or else the writer daemon at `writer-socket`, is
+    unavailable, if either is set.
+    """
+    name = name or conf.get('cache-store') or 'sqlite'
+    store = CACHE_STORES[name]()
+    if not remote:
+        return store
+    if conf.get('server-socket'):
+        from cacheer.server import SocketCacheStore
+        store = SocketCacheStore(store, conf['server-socket'],
+                                 timeout=conf.get('server-timeout', 60))
+    elif conf.get('writer-socket'):
+        from cacheer.writer import WriterClientStore
+        store = WriterClientStore(store, conf['writer-socket'])
+    return store
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-call tracing of cached calls
+
+A trace records the phases of one call of a cached function as spans
+(key, token, meta, read, deserialize, compute, hash, serialize, enqueue),
+tagged with the api name, cache key and outcome. Calls lasting at least
+`slow_threshold` seconds are handed to the tracer's exporters: an
+in-memory ring buffer, a JSON-lines file, or OpenTelemetry.
+
+With no exporter, no trace is started, and spans cost a thread-local
+lookup.
+"""
+
+import time
+import json
+import logging
+import threading
+import collections
+
+LOG = logging.getLogger('cacheer.manager')
+
+_local = threading.local()
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.spans.append(
+            (self.name, self.start, time.perf_counter()))
+        return False
+
+
+def span(name):
+    """
+    Context manager timing phase `name` of the call traced in this thread
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name)
+
+
+def active():
+    return getattr(_local, 'trace', None) is not None
+
+
+def tag(**attrs):
+    """
+    Tag the call traced in this thread, e.g. with its key or outcome
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+class Trace:
+    """
+    Spans of one call, current in its thread while entered
+    """
+
+    def __init__(self, tracer, api_name):
+        self.tracer = tracer
+        self.attrs = {'api': api_name}
+        self.spans = []
+        self.error = None
+
+    def __enter__(self):
+        self._outer = getattr(_local, 'trace', None)
+        _local.trace = self
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        _local.trace = self._outer
+        if exc is not None:
+            self.error = '{}: {}'.format(exc_type.__name__, exc)
+        self.tracer.finish(self)
+        return False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        record = dict(self.attrs)
+        record.update({
+            'start': self.wall_start,
+            'duration': self.duration,
+            'error': self.error,
+            'spans': [{'name': name, 'start': start - self.start,
+                       'duration': end - start}
+                      for name, start, end in self.spans]})
+        return record
+
+
+class Tracer:
+    """
+    Starts traces of cached calls, and exports those lasting at least
+    `slow_threshold` seconds (all by default) to its exporters
+
+    An exporter is anything with an `export(record)` method, `record`
+    being the dict of a trace.
+    """
+
+    def __init__(self, exporters=(), slow_threshold=None):
+        self.exporters = list(exporters)
+        self.slow_threshold = slow_threshold
+
+    @property
+    def enabled(self):
+        return bool(self.exporters)
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        return exporter
+
+    def start(self, api_name):
+        """
+        A new `Trace`, or None if tracing is disabled
+        """
+        if not self.exporters:
+            return None
+        return Trace(self, api_name)
+
+    def finish(self, trace):
+        if self.slow_threshold is not None and \
+                trace.duration < self.slow_threshold:
+            return
+        record = trace.to_dict()
+        for exporter in self.exporters:
+            try:
+                exporter.export(record)
+            except Exception:
+                LOG.warning('Trace export to %s failed',
+                            type(exporter).__name__, exc_info=True)
+
+
+class RingBufferExporter:
+    """
+    Keeps the last `size` traces in memory
+    """
+
+    def __init__(self, size=1000):
+        self.records = collections.deque(maxlen=size)
+
+    def export(self, record):
+        self.records.append(record)
+
+    def traces(self):
+        return list(self.records)
+
+
+class JsonLinesExporter:
+    """
+    Appends traces to the file at `path`, one JSON object per line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+class OpenTelemetryExporter:
+    """
+    Emits each trace as an OpenTelemetry span of the call, with a child
+    span per phase, through `tracer` (the global tracer provider's by
+    default)
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer('cacheer')
+
+    def export(self, record):
+        from opentelemetry.trace import Status, StatusCode
+
+        start_ns = int(record['start'] * 1e9)
+        attrs = {'cacheer.' + k: str(v) for k, v in record.items()
+                 if k not in ('start', 'duration', 'error', 'spans')
+                 and v is not None}
+        root = self.tracer.start_span(
+            'cacheer ' + record['api'], start_time=start_ns,
+            attributes=attrs)
+        context = self._trace.set_span_in_context(root)
+        for s in record['spans']:
+            span_start = start_ns + int(s['start'] * 1e9)
+            child = self.tracer.start_span(
+                s['name'], context=context, start_time=span_start)
+            child.end(end_time=span_start + int(s['duration'] * 1e9))
+        if record['error']:
+            root.set_status(Status(StatusCode.ERROR, record['error']))
+        root.end(end_time=start_ns + int(record['duration'] * 1e9))
+
+
+EXPORTERS = {
+    'ring': RingBufferExporter,
+    'jsonl': JsonLinesExporter,
+    'otel': OpenTelemetryExporter,
+}
+
+
+def configure(tracer, settings):
+    """
+    Add the exporters and threshold of the `tracing` section of config to
+    `tracer`
+    """
+    settings = settings or {}
+    if settings.get('slow-threshold') is not None:
+        tracer.slow_threshold = settings['slow-threshold']
+    for name in settings.get('exporters') or []:
+        if name == 'ring':
+            exporter = RingBufferExporter(settings.get('ring-size', 1000))
+        elif name == 'jsonl':
+            exporter = JsonLinesExporter(settings['jsonl-path'])
+        else:
+            exporter = EXPORTERS[name]()
+        tracer.add_exporter(exporter)
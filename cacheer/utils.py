@@ -1,20 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import os
-import logging.config
-
-import yaml
 
 import time
+import random
+import reprlib
 import functools
 
 import hashlib
+import pickle
+import weakref
 import __main__
 
-import pandas as pd
-from pandas.io.pickle import pkl
-from pandas.io import packers
-
 import logging
 LOG = logging.getLogger('cacheer.manager')
 
@@ -33,20 +30,49 @@ def timeit(func):
     return wrapper
 
 
+# obj -> name of its method to call in forked children
+_after_fork = weakref.WeakKeyDictionary()
+_after_fork_registered = False
+
+
+def _run_after_fork():
+    for obj, method in list(_after_fork.items()):
+        try:
+            getattr(obj, method)()
+        except Exception:
+            LOG.error('%s.%s failed after fork', type(obj).__name__, method,
+                      exc_info=True)
+
+
+def after_fork(obj, method):
+    """
+    Call method `method` of `obj` in the child of each fork, for as long as
+    `obj` lives, to drop state that doesn't survive it (threads, handles)
+    """
+    global _after_fork_registered
+    if not hasattr(os, 'register_at_fork'):
+        return
+    if not _after_fork_registered:
+        os.register_at_fork(after_in_child=_run_after_fork)
+        _after_fork_registered = True
+    _after_fork[obj] = method
+
+
 def serialize(obj):
     if isinstance(obj, bytes):
         return obj
-    return pkl.dumps(obj, pkl.HIGHEST_PROTOCOL)
+    return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
 
 
 def deserialize(b):
-    return pkl.loads(b)
+    return pickle.loads(b)
 
 
 def deserialize_exp(b):
     try:
         return deserialize(b)
     except:
+        from pandas.io import packers
         return packers.read_msgpack(b)
 
 
@@ -91,20 +117,96 @@ def get_api_name(func):
     return api_name
 
 
-def get_mp_logger(settings, logger_name):
+class ArgRepr(reprlib.Repr):
+    """
+    Lazy, truncated repr of cache arguments for log records
+
+    Formatting only happens if a handler actually emits the record. Large
+    containers are cut by `reprlib` limits, and arrays/frames are reduced
+    to their type and shape.
+    """
+
+    def __init__(self, obj, maxlength=200):
+        super().__init__()
+        self.obj = obj
+        self.maxlength = maxlength
+        self.maxlevel = 3
+        self.maxdict = self.maxlist = self.maxtuple = self.maxset = 8
+        self.maxstring = self.maxother = 60
+
+    def _repr_shaped(self, x, level):
+        dtype = getattr(x, 'dtype', None)
+        dtype = f' {dtype}' if dtype is not None else ''
+        return f'<{type(x).__name__}{dtype} {x.shape}>'
+
+    repr_DataFrame = repr_Series = repr_ndarray = repr_Table = _repr_shaped
 
+    def repr_OrderedDict(self, x, level):
+        return self.repr_dict(x, level)
+
+    def __str__(self):
+        s = self.repr(self.obj)
+        if len(s) > self.maxlength:
+            s = s[:self.maxlength - 3] + '...'
+        return s
+
+    __repr__ = __str__
+
+
+class LogSampler:
+    """
+    Per-outcome sampling of info logs
+
+    `rates` maps an outcome (e.g. 'hit', 'miss') to the fraction of
+    calls that get logged, outcomes not listed are always logged.
+    """
+
+    def __init__(self, rates=None):
+        self.rates = dict(rates or {})
+
+    def sample(self, outcome):
+        rate = self.rates.get(outcome, 1.)
+        if rate >= 1.:
+            return True
+        if rate <= 0.:
+            return False
+        return random.random() < rate
+
+
+def get_mp_logger(settings, logger_name, mode='mp'):
+    """
+    Configure logging and make `logger_name` safe to use across processes
+
+    Parameters
+    ----------
+    settings: `dict`
+        logging dict config
+    logger_name: `str`
+    mode: `str`
+        'mp' wraps each handler of the logger in a MultiProcessingHandler,
+        'shared' routes handlers reachable from the logger through one
+        queue and listener thread shared by the process tree,
+        'plain' leaves handlers as they are
+    """
+
+    import logging.config
     try:
         logging.config.dictConfig(settings)
     except:
         logging.basicConfig(level=logging.INFO)
-    
+
     # This is a fix for logging in multiple processes
     # Source: https://github.com/jruere/multiprocessing-logging.git
     # FIXME: use zmq.log
     from cacheer import multiprocessing_logging
     logger = logging.getLogger(logger_name)
-    multiprocessing_logging.install_mp_handler(logger)
+    if mode == 'mp':
+        multiprocessing_logging.install_mp_handler(logger)
+    elif mode == 'shared':
+        multiprocessing_logging.install_shared_queue_handler(logger)
+    elif mode != 'plain':
+        raise ValueError(f'Unknown logging mode: {mode}')
 
     logger = logging.getLogger(logger_name)
 
-    return logger
\ No newline at end of file
+    return logger
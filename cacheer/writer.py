@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cache writers
+
+`WriteQueue` runs the cache writes of a process in background threads.
+
+`WriterDaemon` applies the cache writes of every process on a node, in
+batched transactions, so readers only ever contend with one writer
+
+    python -m cacheer writer --socket /tmp/cacheer-writer.sock
+
+With `writer-socket` set in config, cache stores hand it serialized values
+through the socket and return as soon as they are sent, and write locally
+whenever the daemon can't be reached.
+"""
+
+import os
+import queue
+import atexit
+import socket
+import logging
+import weakref
+import itertools
+import threading
+import collections
+
+from cacheer import ipc
+from cacheer.serializer import serializer, Chunks
+from cacheer.utils import after_fork
+
+LOG = logging.getLogger('cacheer.manager')
+
+
+class WriteQueue:
+    """
+    Background writes, bounded by the bytes they hold
+
+    Writes submitted with a `key` replace a pending write of the same key.
+    Once pending and running writes hold `max_bytes`, new ones are handled
+    by `policy`: 'block' waits for room, 'drop' discards them, 'inline'
+    runs them in the submitting thread. Pending writes are drained at exit.
+    """
+
+    POLICIES = ('block', 'drop', 'inline')
+
+    def __init__(self, max_bytes=1024 ** 3, max_workers=4, policy='block',
+                 name='CacheWriter'):
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.policy = policy
+        self.name = name
+        self.exit_timeout = None
+
+        self.superseded = 0
+        self.dropped = 0
+        self.inlined = 0
+
+        self._reset()
+        after_fork(self, '_reset')
+        atexit.register(self._drain_at_exit)
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy):
+        if policy not in self.POLICIES:
+            raise ValueError('policy should be one of {}'.format(
+                self.POLICIES))
+        self._policy = policy
+
+    def _reset(self):
+        # also in a forked child, whose copy of the queue has no workers,
+        # and leaves the writes pending at fork to the parent
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._pending = collections.OrderedDict()
+        self._bytes = 0
+        self._running = 0
+        self._workers = []
+        self._closed = False
+        self._ids = itertools.count()
+
+    def submit(self, task, key=None, size=0):
+        if self._pid != os.getpid():
+            self._reset()
+
+        with self._cond:
+            if key is not None and key in self._pending:
+                _, superseded_size = self._pending[key]
+                self._pending[key] = (task, size)
+                self._bytes += size - superseded_size
+                self.superseded += 1
+                return
+
+            inline = self._closed
+            if not inline and self._bytes + size > self.max_bytes and (
+                    self._pending or self._running):
+                if self.policy == 'drop':
+                    self.dropped += 1
+                    LOG.warning('Write queue full, write of %s dropped', key)
+                    return
+                elif self.policy == 'inline':
+                    inline = True
+                else:
+                    self._cond.wait_for(
+                        lambda: self._bytes + size <= self.max_bytes or not (
+                            self._pending or self._running))
+
+            if not inline:
+                if key is None:
+                    key = (None, next(self._ids))
+                self._pending[key] = (task, size)
+                self._bytes += size
+                if len(self._workers) < min(self.max_workers,
+                                            len(self._pending) +
+                                            self._running):
+                    self._start_worker()
+                self._cond.notify()
+                return
+
+        self.inlined += 1
+        self._run(task)
+
+    def _start_worker(self):
+        worker = threading.Thread(
+            target=self._work, daemon=True,
+            name='{}_{}'.format(self.name, len(self._workers)))
+        self._workers.append(worker)
+        worker.start()
+
+    @staticmethod
+    def _run(task):
+        try:
+            task()
+        except:
+            LOG.error('Cache write failed', exc_info=True)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                _, (task, size) = self._pending.popitem(last=False)
+                self._running += 1
+            try:
+                self._run(task)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._bytes -= size
+                    self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait for pending writes to finish, returning False on timeout
+        """
+        if self._pid != os.getpid():
+            return True
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not (self._pending or self._running), timeout)
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait and self._pid == os.getpid():
+            for worker in self._workers:
+                worker.join()
+
+    def _drain_at_exit(self):
+        if self._pending or self._running:
+            if not self.flush(self.exit_timeout):
+                LOG.warning('%d cache writes lost at exit',
+                            len(self._pending) + self._running)
+
+    def stats(self):
+        return {'pending': len(self._pending), 'running': self._running,
+                'bytes': self._bytes, 'superseded': self.superseded,
+                'dropped': self.dropped, 'inlined': self.inlined}
+
+
+OPS = ['write', 'write_meta', 'delete', 'delete_meta', 'sync']
+WRITE, WRITE_META, DELETE, DELETE_META, SYNC = range(len(OPS))
+
+
+class WriterDaemon:
+    """
+    Receives ops from any number of connections, one thread each, and
+    applies them from a single thread, batching whatever is pending up to
+    `batch_size` ops or `batch_bytes` bytes into one transaction
+
+    Ops received but not applied yet hold at most `max_bytes`; past it,
+    writes are handled by `policy` like in `WriteQueue`: 'block' stops
+    reading from their connection until there's room, 'drop' discards
+    them. Deletes and syncs are always queued.
+
+    With `vacuum_interval`, free pages of the store are given back to the
+    file system once no op came for that many seconds.
+    """
+
+    POLICIES = ('block', 'drop')
+
+    def __init__(self, path, store, batch_size=256,
+                 batch_bytes=64 * 1024 * 1024, vacuum_interval=None,
+                 max_bytes=1024 ** 3, policy='block'):
+        if policy not in self.POLICIES:
+            raise ValueError('policy should be one of {}'.format(
+                self.POLICIES))
+        self.path = path
+        self.store = store
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.max_bytes = max_bytes
+        self.policy = policy
+
+        self.compactor = None
+        if vacuum_interval and hasattr(store, 'incremental_vacuum'):
+            from cacheer.store import IdleCompactor
+            self.compactor = IdleCompactor(store, vacuum_interval)
+
+        self.applied = 0
+        self.batches = 0
+        self.dropped = 0
+
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._bytes = 0
+        self._stop = threading.Event()
+
+    def serve_forever(self):
+        listener = ipc.listen(self.path)
+        listener.settimeout(0.5)
+        applier = threading.Thread(target=self._apply_loop,
+                                   name='CacheWriterDaemon')
+        applier.start()
+        LOG.info('%s listening on %s', type(self).__name__, self.path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._receive, args=(conn,),
+                                 daemon=True).start()
+        finally:
+            listener.close()
+            os.unlink(self.path)
+            self._queue.put(None)
+            applier.join()
+            LOG.info('%s stopped, %d ops applied in %d batches',
+                     type(self).__name__, self.applied, self.batches)
+
+    def shutdown(self):
+        self._stop.set()
+
+    def _enqueue(self, op, key, payload, conn):
+        size = len(payload)
+        with self._cond:
+            if op in (WRITE, WRITE_META) and self._bytes and \
+                    self._bytes + size > self.max_bytes:
+                if self.policy == 'drop':
+                    self.dropped += 1
+                    LOG.warning('Cache writer queue full, write of %s '
+                                'dropped', key)
+                    return False
+                self._cond.wait_for(
+                    lambda: not self._bytes or
+                    self._bytes + size <= self.max_bytes)
+            self._bytes += size
+        self._queue.put((op, key, payload, conn))
+        return True
+
+    def _receive(self, conn):
+        try:
+            while True:
+                op, key, payload = ipc.recv_frame(conn)
+                self._enqueue(op, key, payload, conn)
+        except ipc.ConnectionClosed:
+            pass
+        except OSError:
+            LOG.warning('Cache writer connection lost', exc_info=True)
+
+    def _apply_loop(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, size = [item], len(item[2])
+            while len(batch) < self.batch_size and size < self.batch_bytes:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[2])
+            self._apply(batch)
+
+    def _apply(self, batch):
+        ops = [(OPS[op], key, Chunks([payload]))
+               for op, key, payload, _ in batch if op != SYNC]
+        if ops:
+            try:
+                self._write_batch(ops)
+            except:
+                LOG.error('Cache writer batch failed, %d ops lost',
+                          len(ops), exc_info=True)
+            self.applied += len(ops)
+            self.batches += 1
+            if self.compactor is not None:
+                self.compactor.touch()
+
+        with self._cond:
+            self._bytes -= sum(len(payload) for _, _, payload, _ in batch)
+            self._cond.notify_all()
+
+        for op, _, _, conn in batch:
+            if op == SYNC:
+                try:
+                    conn.sendall(b'\x01')
+                except OSError:
+                    pass
+
+    def _write_batch(self, ops):
+        from cacheer.store import _write_batch
+        _write_batch(self.store, ops)
+
+
+class _Connection:
+    # a thread's socket, locked around each exchange so that `sync` can
+    # use it from another thread
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+
+class WriterClientStore:
+    """
+    Cache store sending writes and deletes to a `WriterDaemon` at `path`,
+    everything else going to `store`
+    """
+
+    def __init__(self, store, path, timeout=5):
+        self.store = store
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # connections of all threads, for as long as their thread lives
+        self._conns = weakref.WeakSet()
+        self._conns_lock = threading.Lock()
+        self._daemon_lost = False
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or conn.pid != os.getpid():
+            # not a socket inherited from the parent process
+            conn = _Connection(ipc.connect(self.path, self.timeout))
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.add(conn)
+        return conn
+
+    def _sock(self):
+        return self._conn().sock
+
+    def _lost(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.sock.close()
+            self._local.conn = None
+        if not self._daemon_lost:
+            LOG.warning('Cache %s at %s unavailable, using local store',
+                        type(self).__name__, self.path, exc_info=True)
+        self._daemon_lost = True
+
+    def _send(self, op, key, payload=b''):
+        try:
+            conn = self._conn()
+            with conn.lock:
+                ipc.send_frame(conn.sock, op, key, payload)
+        except OSError:
+            self._lost()
+            return False
+        self._daemon_lost = False
+        return True
+
+    def write(self, key, value):
+        if not self._send(WRITE, key, serializer.serialize(value)):
+            self.store.write(key, value)
+
+    def write_meta(self, key, meta):
+        if not self._send(WRITE_META, key, serializer.serialize(meta)):
+            self.store.write_meta(key, meta)
+
+    def delete(self, key):
+        if not self._send(DELETE, key):
+            self.store.delete(key)
+
+    def delete_meta(self, key):
+        if not self._send(DELETE_META, key):
+            self.store.delete_meta(key)
+
+    def sync(self):
+        """
+        Wait until the ops sent by any thread of this process are applied
+        """
+        with self._conns_lock:
+            conns = [conn for conn in self._conns
+                     if conn.pid == os.getpid()]
+        for conn in conns:
+            with conn.lock:
+                if conn.sock.fileno() < 0:  # lost
+                    continue
+                try:
+                    ipc.send_frame(conn.sock, SYNC, '', b'')
+                    ipc.recv_exact(conn.sock, 1)
+                except OSError:
+                    # the owning thread then finds it closed and writes
+                    # locally
+                    LOG.warning('Cache %s at %s unavailable',
+                                type(self).__name__, self.path,
+                                exc_info=True)
+                    conn.sock.close()